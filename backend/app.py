@@ -2,28 +2,41 @@ import datetime
 import json
 import os
 import random
+import threading
+import time
+from collections import deque
 from datetime import timedelta
 from pathlib import Path
 from uuid import uuid4
 
+# everything below is counted as import time on /ready
+started = time.perf_counter()
+
 import openai
 import uvicorn
+from audio import SAMPLING_RATE, decode_audio
+from batcher import IMAGE_BATCH_SIZE, TEXT_BATCH_SIZE
+from cache import result_cache
 from db import DBclient
+from directory import TherapistDirectory
+from history import ChatHistory
+from jobs import PRIORITIES, JobQueue, QueueFull
 from dotenv import load_dotenv
 from fastapi import BackgroundTasks, FastAPI, File, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from scraper import Scraper
-from typing import List
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from lazy import Lazy
+from metrics import registry, render, sample_stacks
+from scraper import DriverPool, Scraper, practo_url
+from typing import List, Optional
 from scraper import create_dict
 from pydantic import BaseModel
-from llm import llm, openai_moderate
-from models import Analyzer
+from llm import gateway, llm, moderate_texts, moderation_batcher, openai_moderate
 from prompts import reflect_prompt, user_prompt
-from pydub import AudioSegment
-from pyngrok import ngrok
+from rollups import PERIODS
 
 load_dotenv()
-ngrok.set_auth_token(token := os.getenv("NGROK_TOKEN"))
 
 running = {"status": "running"}
 success = {"status": "success"}
@@ -32,10 +45,37 @@ fail = {"status": "fail"}
 SAVE_DIR = "images"
 os.makedirs(SAVE_DIR, exist_ok=True)
 
-analyzer = Analyzer()
-db = DBclient()
+reflect_timings = deque(maxlen=1000)
+
+
+def load_analyzer():
+    # with MODEL_SERVER set, models live in a shared model_server.py process instead of every worker
+    if model_server := os.getenv("MODEL_SERVER"):
+        from model_server import ModelClient
+
+        return ModelClient(model_server)
+    from models import Analyzer
+
+    return Analyzer()
+
+
+# models and database clients are built on first use, or in the background after startup for those listed in
+# PRELOAD (comma-separated, or "all"), so endpoints that need neither are served as soon as the process is up
+analyzer = Lazy("analyzer", load_analyzer, warmup=lambda analyzer: analyzer.warmup())
+db = Lazy("db", DBclient)
+components = {"analyzer": analyzer, "db": db}
+preload = [name.strip() for name in os.getenv("PRELOAD", "").split(",") if name.strip()]
+preload = list(components) if preload == ["all"] else preload
+if set(preload) - set(components):
+    unknown = ", ".join(sorted(set(preload) - set(components)))
+    raise ValueError(f"unknown PRELOAD components: {unknown} (expected 'all' or some of {', '.join(components)})")
+startup_timings = {}
+# analyses run as jobs: bounded per modality so a burst of uploads is rejected instead of piling up in memory.
+# Text and image jobs run as many at once as their model batches hold, or no batch would ever fill.
+jobs = JobQueue({"text": (1000, TEXT_BATCH_SIZE), "image": (64, IMAGE_BATCH_SIZE), "audio": (16, 1)})
+chat_history = ChatHistory(db, llm)
 app = FastAPI()
-s= Scraper()
+scraper = Scraper(DriverPool(size=2))
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -44,16 +84,70 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def time_requests(request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    registry.observe("mindscape_http_request_seconds", time.perf_counter() - start, route=route, method=request.method, status=response.status_code)
+    return response
+
+
 class CityRequest(BaseModel):
     city: str
+    genders: List[str] = ["male", "female"]
+    min_fee: Optional[int] = None
+    max_fee: Optional[int] = None
+    min_recommendation: Optional[int] = None
+
+
+class ModerationRequest(BaseModel):
+    texts: List[str]
+
+
+def fetch_therapists(city, gender):
+    return create_dict(scraper.scrape_website(practo_url(city, gender)) or [], gender)
 
 
-def process_text(entity, type):
+directory = TherapistDirectory(fetch_therapists, workers=scraper.pool.size)
+
+
+def prewarm():
+    for name in preload:
+        try:
+            components[name].prewarm()
+        except Exception as e:
+            print(f"failed to preload {name}: {e!r}")
+    startup_timings["ready_ms"] = (time.perf_counter() - started) * 1000
+    print(f"ready {startup_timings['ready_ms']:.0f} ms after import")
+
+
+@app.on_event("startup")
+def startup():
+    startup_timings["startup_ms"] = (time.perf_counter() - started) * 1000
+    threading.Thread(target=prewarm, name="prewarm", daemon=True).start()
+
+
+@app.on_event("shutdown")
+def shutdown():
+    scraper.pool.close()
+    # flush buffered sentiment writes before the process exits
+    if db.loaded:
+        db.close()
+
+
+@app.on_event("shutdown")
+async def close_gateway():
+    await gateway.aclose()
+
+
+def process_text(entity, type, document_id=None):
     uid = entity.get("uid", entity.get("userId", None))
     if not uid:
         return fail
 
-    results = analyzer.analyze(entity["content"])
+    # journal notes keep per-sentence scores so the UI can highlight them
+    results = analyzer.analyze(entity["content"], sentences=type == "note")
 
     outdict = dict(
         uid=uid,
@@ -62,14 +156,16 @@ def process_text(entity, type):
         content=entity["content"],
     )
     results = results | outdict
-    db.add_sentiment(uid, results)
+    db.add_sentiment(uid, results, document_id=document_id)
     print(results)
-    return success
+    return results
 
 
-async def process_image(userid, content, q):
+async def process_image(userid, content, q, second_opinion=False):
     try:
-        emotions, remarks = await analyzer.analyze_image(content)
+        # loading the models takes minutes, so it happens on a worker thread rather than the event loop
+        model = await analyzer.aget()
+        emotions, remarks, timings = await model.analyze_image(content, second_opinion=second_opinion)
 
         results = dict(
             uid=userid,
@@ -80,15 +176,15 @@ async def process_image(userid, content, q):
             score=0,
         )
 
-        db.add_sentiment(userid, results, q)
-        print(results)
-        return success
+        await db.add_sentiment_async(userid, results, q)
+        print(results, timings)
+        return results
     except openai.BadRequestError:
         print("image processed")
         return fail
 
 
-async def process_audio(userid, audio_data, q):
+def process_audio(userid, audio_data, q):
     results = analyzer.analyze_audio(audio_data)
     emotions = results["emotion_scores"]
     emotions["sadness"] = emotions.pop("sad")
@@ -107,7 +203,29 @@ async def process_audio(userid, audio_data, q):
     )
     print(outdict)
     db.add_sentiment(userid, outdict, q)
-    return success
+    return outdict
+
+
+def busy(error):
+    return JSONResponse(fail | {"error": error}, status_code=429, headers={"Retry-After": "1"})
+
+
+def enqueue(kind, fn, *args, priority="normal"):
+    if priority not in PRIORITIES:
+        return JSONResponse(fail | {"error": f"priority must be one of {list(PRIORITIES)}"}, status_code=400)
+    try:
+        job = jobs.submit(kind, fn, *args, priority=priority)
+    except QueueFull as e:
+        return busy(str(e))
+    return running | {"job_id": job.id}
+
+
+async def analyze_chat(chat):
+    # the reply has already gone out, so a saturated text queue only costs this turn's sentiment
+    try:
+        jobs.submit("text", process_text, chat, "chat", priority="interactive")
+    except QueueFull as e:
+        print(f"skipped chat analysis: {e}")
 
 
 def save_file(file, extension):
@@ -124,44 +242,142 @@ async def home():
     return success
 
 
+@app.get("/ready")
+def ready():
+    status = {name: component.status() for name, component in components.items()}
+    is_ready = all(status[name]["warmed"] for name in preload)
+    body = {"ready": is_ready, "components": status, "drivers": scraper.pool.created, "timings": startup_timings}
+    return JSONResponse(body, status_code=200 if is_ready else 503)
+
+
+@app.get("/metrics")
+def metrics():
+    for kind, queue in jobs.stats().items():
+        registry.set("mindscape_job_queue_depth", queue["queue_depth"], kind=kind)
+        registry.set("mindscape_jobs_running", queue["running"], kind=kind)
+    if db.loaded:
+        registry.set("mindscape_firestore_pending_writes", db.writer.queue.qsize())
+    snapshots = [registry.snapshot()]
+    # with a model server the model stages are timed in that process
+    if os.getenv("MODEL_SERVER") and analyzer.loaded:
+        snapshots.append(analyzer.metrics())
+    return PlainTextResponse(render(*snapshots), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/profile")
+def profile(seconds: float = 10.0, interval_ms: float = 5.0, target: str = "app"):
+    # opt-in: sampling costs CPU while it runs and the output exposes code paths
+    if not os.getenv("PROFILING"):
+        return JSONResponse(fail | {"error": "profiling is disabled, set PROFILING=1"}, status_code=404)
+    seconds, interval = min(seconds, 60.0), max(interval_ms, 1.0) / 1000
+    if target == "models" and os.getenv("MODEL_SERVER"):
+        return PlainTextResponse(analyzer.profile(seconds, interval))
+    return PlainTextResponse(sample_stacks(seconds, interval))
+
+
+@app.get("/stats")
+def stats():
+    reflect = {}
+    for stream in (False, True):
+        timings = [t for t in reflect_timings if t["stream"] == stream]
+        if timings:
+            reflect["stream" if stream else "plain"] = dict(
+                requests=len(timings),
+                mean_ttft_ms=sum(t.get("ttft_ms", t["total_ms"]) for t in timings) / len(timings),
+                mean_total_ms=sum(t["total_ms"] for t in timings) / len(timings),
+            )
+    return (analyzer.stats() if analyzer.loaded else {}) | {"startup": startup_timings, "jobs": jobs.stats(), "llm": dict(gateway.stats), "moderation_batcher": moderation_batcher.stats(), "reflect": reflect, "cache": result_cache.stats()}
+
+
 @app.post("/therapists")
 def therapists(request: CityRequest):
-    location = request.city.lower()
-    # preferred_genders = [gender.lower() for gender in preferred_therapists]
-    output = []
-    for gender in ["male", "female"]:
-        url = f"https://www.practo.com/{location}/doctors-for-individual-therapy?filters%5Bdoctor_gender%5D%5B%5D={gender}"
-        s = Scraper()
-        html_list = s.scrape_website(url)
-        output.extend(create_dict(html_list, gender))
-    return output
+    return directory.get(
+        request.city,
+        genders=[gender.lower() for gender in request.genders],
+        min_fee=request.min_fee,
+        max_fee=request.max_fee,
+        min_recommendation=request.min_recommendation,
+    )
 
 
 @app.post("/reflect")
 async def reflect(prompt: str, user_id: str, background_tasks: BackgroundTasks) -> str:
-    history = db.get_chat_history(user_id)
+    history = await chat_history.prompt(user_id)
     chat_prompt = user_prompt.format(history, prompt)
+    start = time.perf_counter()
     response = await llm(reflect_prompt, chat_prompt)
+    # without streaming the first token reaches the user with the last one
+    total_ms = (time.perf_counter() - start) * 1000
+    reflect_timings.append({"ttft_ms": total_ms, "total_ms": total_ms, "stream": False})
     chat = dict(
         content=prompt,
         uid=user_id,
     )
-    background_tasks.add_task(process_text, chat, "chat")
+    background_tasks.add_task(chat_history.append, user_id, prompt, response)
+    background_tasks.add_task(analyze_chat, chat)
     return response
 
 
+@app.post("/reflect_stream")
+async def reflect_stream(prompt: str, user_id: str):
+    history = await chat_history.prompt(user_id)
+    chat_prompt = user_prompt.format(history, prompt)
+    chunks = []
+    timing = {}
+
+    async def events():
+        start = time.perf_counter()
+        async for delta in gateway.stream(reflect_prompt, chat_prompt):
+            if not chunks:
+                timing["ttft_ms"] = (time.perf_counter() - start) * 1000
+            chunks.append(delta)
+            yield f"data: {json.dumps(delta)}\n\n"
+        timing["total_ms"] = (time.perf_counter() - start) * 1000
+        reflect_timings.append(timing | {"stream": True})
+        yield f"event: done\ndata: {json.dumps(timing)}\n\n"
+
+    async def save_turn():
+        await chat_history.append(user_id, prompt, "".join(chunks))
+
+    # starlette only runs these once the whole stream has been sent
+    chat = dict(
+        content=prompt,
+        uid=user_id,
+    )
+    background = BackgroundTasks()
+    background.add_task(save_turn)
+    background.add_task(analyze_chat, chat)
+    return StreamingResponse(events(), media_type="text/event-stream", background=background)
+
+
 @app.post("/analyze_post")
-async def analyze_post(room_id: str, post_id: str, background_tasks: BackgroundTasks):
-    post = db.get_post(room_id, post_id)
-    background_tasks.add_task(process_text, post, "post")
-    return running
+async def analyze_post(room_id: str, post_id: str, priority: str = "normal"):
+    post = await db.get_post_async(room_id, post_id)
+    # the same id backfill.py writes, so rescoring a post replaces its sentiment
+    document_id = DBclient.sentiment_id("post", f"forum/{room_id}/messages/{post_id}")
+    return enqueue("text", process_text, post, "post", document_id, priority=priority)
 
 
 @app.post("/analyze_note")
-async def analyze_note(user_id: str, note_id: str, background_tasks: BackgroundTasks):
-    note = db.get_note(user_id, note_id)
-    background_tasks.add_task(process_text, note, "note")
-    return running
+async def analyze_note(user_id: str, note_id: str, priority: str = "normal"):
+    note = await db.get_note_async(user_id, note_id)
+    document_id = DBclient.sentiment_id("note", f"users/{user_id}/journal/{note_id}")
+    return enqueue("text", process_text, note, "note", document_id, priority=priority)
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        return JSONResponse(fail | {"error": "unknown or expired job"}, status_code=404)
+    return job.view()
+
+
+@app.get("/rollups")
+async def rollups(user_id: str, period: str = "day", start: Optional[str] = None, end: Optional[str] = None, q: bool = False):
+    if period not in PERIODS:
+        return fail
+    return await db.get_rollups_async(user_id, period, start, end, q)
 
 
 @app.post("/moderate")
@@ -172,12 +388,18 @@ async def moderate(text: str) -> str:
     return success
 
 
+@app.post("/moderate_batch")
+async def moderate_batch(request: ModerationRequest):
+    return await moderate_texts(request.texts)
+
+
 @app.post("/analyze_image")
 async def analyze_image(
     user_id: str,
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     q=False,
+    second_opinion: bool = False,
+    priority: str = "normal",
 ):
     q = bool(q)
     image_bytes = await file.read()
@@ -186,38 +408,40 @@ async def analyze_image(
 
     # with open(image_path, "wb") as img_file:
     #     img_file.write(image_bytes)
-    background_tasks.add_task(process_image, user_id, image_bytes, q)
-    return running
+    return enqueue("image", process_image, user_id, image_bytes, q, second_opinion, priority=priority)
 
 
 @app.post("/analyze_audio")
 async def analyze_audio(
     user_id: str,
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     q=False,
+    priority: str = "normal",
 ):
     q = bool(q)
+    if jobs.saturated("audio"):
+        # don't spend time decoding a clip that can't be queued
+        return busy("audio queue is full")
     audio_bytes = await file.read()
-
-    original_file_path = Path(SAVE_DIR) / f"{user_id}_input.{file.filename.split('.')[-1]}"
-    converted_file_path = Path(SAVE_DIR) / f"{uuid4()}_converted.wav"
-
-    with open(original_file_path, "wb") as f:
-        f.write(audio_bytes)
+    extension = Path(file.filename).suffix if file.filename else None
 
     try:
-        audio = AudioSegment.from_file(original_file_path)
-        audio.export(converted_file_path, format="wav")
+        with registry.stage("audio_decode"):
+            audio_array = await run_in_threadpool(decode_audio, audio_bytes, SAMPLING_RATE, extension)
     except Exception as e:
         return {"error": f"Failed to process audio: {str(e)}"}
 
-    background_tasks.add_task(process_audio, user_id, converted_file_path, q)
+    return enqueue("audio", process_audio, user_id, audio_array, q, priority=priority)
+
 
-    return {"status": "running", "wav_path": str(converted_file_path)}
+startup_timings["import_ms"] = (time.perf_counter() - started) * 1000
 
 
 if __name__ == "__main__":
+    if token := os.getenv("NGROK_TOKEN"):
+        from pyngrok import ngrok
+
+        ngrok.set_auth_token(token)
     # public_url = ngrok.connect(8000)
     # print(f" * ngrok tunnel available at {public_url}")
     uvicorn.run(
@@ -0,0 +1,54 @@
+import io
+import tempfile
+
+import numpy as np
+import soundfile as sf
+import soxr
+from pydub import AudioSegment
+
+# the rate the audio emotion model's feature extractor expects, known before the model is loaded
+SAMPLING_RATE = 16000
+
+# containers ffmpeg can't demux from a pipe (index stored at the end of the file)
+SPILL_FORMATS = {"mp4", "m4a", "mov", "3gp", "3g2"}
+
+
+def to_mono(audio_array):
+    if audio_array.ndim == 2:
+        audio_array = audio_array.mean(axis=1) if audio_array.shape[1] > 1 else audio_array[:, 0]
+    return np.ascontiguousarray(audio_array, dtype=np.float32)
+
+
+def resample(audio_array, orig_sr, target_sr):
+    if orig_sr == target_sr:
+        return audio_array
+    return soxr.resample(audio_array, orig_sr, target_sr, quality="HQ")
+
+
+def decode_segment(segment: AudioSegment):
+    samples = np.array(segment.get_array_of_samples(), dtype=np.float32) / float(1 << (8 * segment.sample_width - 1))
+    return to_mono(samples.reshape(-1, segment.channels)), segment.frame_rate
+
+
+def decode_ffmpeg(audio_bytes: bytes, extension=None):
+    if extension in SPILL_FORMATS:
+        with tempfile.NamedTemporaryFile(suffix=f".{extension}") as f:
+            f.write(audio_bytes)
+            f.flush()
+            return decode_segment(AudioSegment.from_file(f.name, format=extension))
+    return decode_segment(AudioSegment.from_file(io.BytesIO(audio_bytes), format=extension))
+
+
+def decode_audio(audio_bytes: bytes, sampling_rate: int, extension=None):
+    """
+    Decodes uploaded audio bytes to a mono float32 array at `sampling_rate`, entirely in memory.
+    libsndfile handles wav/flac/ogg/mp3 directly; everything else goes through ffmpeg over a pipe,
+    and only containers listed in SPILL_FORMATS are written to a temporary file.
+    """
+    extension = extension.lower().lstrip(".") if extension else None
+    try:
+        audio_array, orig_sr = sf.read(io.BytesIO(audio_bytes), dtype="float32", always_2d=True)
+        audio_array = to_mono(audio_array)
+    except (sf.LibsndfileError, RuntimeError, TypeError):
+        audio_array, orig_sr = decode_ffmpeg(audio_bytes, extension)
+    return resample(audio_array, orig_sr, sampling_rate)
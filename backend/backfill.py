@@ -0,0 +1,280 @@
+"""
+Re-scores stored journal notes and forum posts, e.g. after a model change.
+
+Documents are streamed from users/*/journal and forum/*/messages in path order, a page at a time. Each
+page is analyzed in batches by a pool of worker processes, each with its own text-only Analyzer. The
+results are written back through DBclient's batched writer as sentiments with the fixed ids the app also
+uses for notes and posts, so running again overwrites them instead of adding duplicates. By default they
+go to users/*/rescored_sentiments; pass --prefix "" to replace the live sentiments instead.
+
+Rollups are never incremented here, since a resumed or repeated run would count documents twice. With
+--rollups, <prefix>rollups_* are rebuilt from scratch out of <prefix>sentiments once rescoring is done.
+Sentiments the app stored under random ids before it used fixed ones are left out of the rebuild when a
+rescored sentiment of the same type and content exists. App writes landing mid-rebuild can be lost, so
+run it while traffic is quiet.
+
+The position in each source is checkpointed after every page, once that page's writes are committed.
+Run the same command again to resume. Set FIRESTORE_EMULATOR_HOST, or pass --emulator, to run against
+the Firestore emulator.
+
+    python backfill.py --sources journal forum --workers 4 --rate 50 --prefix v2_ --rollups
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+# source: (collection group, top-level collection it lives under, sentiment type the app stores it as)
+SOURCES = {
+    "journal": ("journal", "users", "note"),
+    "forum": ("messages", "forum", "post"),
+}
+
+analyzer = None
+executor = None
+
+
+def init_worker(engine, threads):
+    global analyzer, executor
+    if threads:
+        import torch
+
+        torch.set_num_threads(threads)
+    from models import Analyzer
+
+    analyzer = Analyzer(engine=engine, image_backend="openai", audio=False)
+    # enough texts in flight to fill the micro-batcher and overlap the Google NL calls
+    executor = ThreadPoolExecutor(analyzer.text_batcher.max_batch_size)
+
+
+def analyze_one(text, sentences):
+    try:
+        return analyzer.analyze(text, sentences=sentences)
+    except Exception as e:
+        return {"error": repr(e)}
+
+
+def analyze_batch(texts, sentences):
+    return analyzer.text_version, list(executor.map(lambda text: analyze_one(text, sentences), texts))
+
+
+def documents(page, root):
+    for snapshot in page:
+        parts = snapshot.reference.path.split("/")
+        # the collection group also matches same-named subcollections anywhere else
+        if len(parts) != 4 or parts[0] != root:
+            continue
+        data = snapshot.to_dict() or {}
+        uid = data.get("uid", data.get("userId"))
+        content = data.get("content")
+        if uid and isinstance(content, str) and content.strip():
+            yield snapshot.reference.path, uid, content, data.get("createdAt")
+
+
+class Throttle:
+    """Spaces out work to at most `rate` documents per second on average; 0 means no limit."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.next = time.monotonic()
+
+    def wait(self, count):
+        if not self.rate:
+            return
+        delay = self.next - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.next = max(self.next, time.monotonic()) + count / self.rate
+
+
+class Progress:
+    def __init__(self, source, total, seen):
+        self.source = source
+        self.total = total
+        self.start = time.monotonic()
+        self.initial = seen
+
+    def update(self, state):
+        seen = state["done"] + state["skipped"] + state["failed"]
+        rate = (seen - self.initial) / max(time.monotonic() - self.start, 1e-9)
+        line = f"{self.source}: {seen}/{self.total if self.total is not None else '?'} docs, {state['failed']} failed, {rate:.1f} docs/s"
+        if self.total is not None and rate > 0:
+            line += f", ETA {datetime.timedelta(seconds=int(max(self.total - seen, 0) / rate))}"
+        sys.stderr.write(f"\r{line}\033[K")
+        sys.stderr.flush()
+
+
+def load_checkpoint(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_checkpoint(path, checkpoint):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp, path)
+
+
+def backfill(db, pool, source, args, checkpoint):
+    group, root, kind = SOURCES[source]
+    state = checkpoint.setdefault(source, {"after": None, "done": 0, "skipped": 0, "failed": 0, "finished": False})
+    if state["finished"]:
+        print(f"{source}: already finished, pass --restart to run it again")
+        return
+    # counts same-named subcollections elsewhere too, so the ETA is an upper bound
+    total = db.count(group) if args.count else None
+    progress = Progress(source, total, state["done"] + state["skipped"] + state["failed"])
+    throttle = Throttle(args.rate)
+    processed = 0
+
+    for page in db.collection_pages(group, args.page_size, state["after"]):
+        items = list(documents(page, root))
+        state["skipped"] += len(page) - len(items)
+        futures = {}
+        for i in range(0, len(items), args.batch_size):
+            batch = items[i : i + args.batch_size]
+            throttle.wait(len(batch))
+            futures[pool.submit(analyze_batch, [content for _, _, content, _ in batch], kind == "note")] = batch
+
+        for future in as_completed(futures):
+            version, results = future.result()
+            now = datetime.datetime.now(datetime.timezone.utc)
+            for (path, uid, content, created), result in zip(futures[future], results):
+                if "error" in result:
+                    state["failed"] += 1
+                    print(f"\n{path}: {result['error']}", file=sys.stderr)
+                    continue
+                sentiment = result | dict(
+                    uid=uid, type=kind, createdAt=created or now, content=content, source=path, modelVersion=version, rescoredAt=now
+                )
+                writes = db.sentiment_writes(uid, sentiment, prefix=args.prefix, document_id=db.sentiment_id(kind, path))
+                if not args.dry_run:
+                    # only the sentiment itself, its rollup increments are left to rebuild_rollups
+                    db.writer.add(writes[0])
+                state["done"] += 1
+            progress.update(state)
+
+        processed += len(page)
+        if not args.dry_run:
+            dropped = db.writer.stats["dropped"]
+            db.writer.flush()
+            if db.writer.stats["dropped"] > dropped:
+                sys.exit(f"\n{source}: Firestore dropped writes, stopping before {page[0].reference.path} is checkpointed")
+            state["after"] = page[-1].reference.path
+            save_checkpoint(args.checkpoint, checkpoint)
+        if args.limit and processed >= args.limit:
+            print(f"\n{source}: stopped after {processed} docs (--limit)")
+            return
+    state["finished"] = True
+    if not args.dry_run:
+        save_checkpoint(args.checkpoint, checkpoint)
+    print(f"\n{source}: {state['done']} scored, {state['skipped']} skipped, {state['failed']} failed")
+
+
+def superseded(sentiments):
+    # app writes from before fixed ids carry no source; drop those a rescored sentiment replaces
+    rescored = {(s.get("type"), s.get("content")) for s in sentiments if s.get("source")}
+    return [s for s in sentiments if s.get("source") or (s.get("type"), s.get("content")) not in rescored]
+
+
+def rebuild_user(db, uid, sentiments, args):
+    from rollups import PERIODS, rollup_totals
+
+    totals = rollup_totals(superseded(sentiments))
+    user = db.client.collection("users").document(uid)
+    writes = []
+    for period in PERIODS:
+        rollups = user.collection(f"{args.prefix}rollups_{period}")
+        writes.extend((rollups.document(key), data, False) for (bucket_period, key), data in totals.items() if bucket_period == period)
+        # buckets left over from double counting or moved createdAt dates
+        writes.extend((snapshot.reference, None, False) for snapshot in rollups.stream() if (period, snapshot.id) not in totals)
+    if not args.dry_run:
+        db.writer.add(*writes)
+    return len(writes)
+
+
+def rebuild_rollups(db, args):
+    collection = f"{args.prefix}sentiments"
+    uid, sentiments, users, writes = None, [], 0, 0
+    # collection pages are ordered by path, so each user's sentiments arrive together
+    for page in db.collection_pages(collection, args.page_size):
+        for snapshot in page:
+            parts = snapshot.reference.path.split("/")
+            if len(parts) != 4 or parts[0] != "users":
+                continue
+            if parts[1] != uid:
+                if uid is not None:
+                    writes += rebuild_user(db, uid, sentiments, args)
+                    users += 1
+                uid, sentiments = parts[1], []
+            sentiments.append(snapshot.to_dict() or {})
+        sys.stderr.write(f"\rrollups: {users} users rebuilt\033[K")
+    if uid is not None:
+        writes += rebuild_user(db, uid, sentiments, args)
+        users += 1
+    if not args.dry_run:
+        dropped = db.writer.stats["dropped"]
+        db.writer.flush()
+        if db.writer.stats["dropped"] > dropped:
+            sys.exit("\nrollups: Firestore dropped writes, run --rollups again")
+    print(f"\nrollups: {users} users, {writes} rollup documents written or removed in {args.prefix}rollups_*")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score stored journal notes and forum posts")
+    parser.add_argument("--sources", nargs="+", choices=list(SOURCES), default=list(SOURCES))
+    parser.add_argument("--workers", type=int, default=2, help="analyzer processes, 0 to analyze in this process")
+    parser.add_argument("--batch-size", type=int, default=32, help="texts sent to a worker at a time")
+    parser.add_argument("--page-size", type=int, default=500, help="documents read per query")
+    parser.add_argument("--rate", type=float, default=0, help="max documents per second, 0 for no limit")
+    parser.add_argument("--limit", type=int, default=0, help="stop each source after about this many documents")
+    parser.add_argument("--prefix", default="rescored_", help='write to users/*/<prefix>sentiments, "" for the live sentiments')
+    parser.add_argument("--rollups", action="store_true", help="rebuild <prefix>rollups_* from <prefix>sentiments afterwards")
+    parser.add_argument("--checkpoint", default="backfill.checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from the beginning")
+    parser.add_argument("--dry-run", action="store_true", help="analyze without writing results or the checkpoint")
+    parser.add_argument("--no-count", dest="count", action="store_false", help="skip the count query, no ETA")
+    parser.add_argument("--engine", default=os.getenv("INFERENCE_ENGINE", "torch"), choices=["torch", "onnx"])
+    parser.add_argument("--emulator", help="host:port of a Firestore emulator")
+    parser.add_argument("--project", help="Firestore project id for the emulator")
+    args = parser.parse_args()
+
+    if args.emulator:
+        os.environ["FIRESTORE_EMULATOR_HOST"] = args.emulator
+    if args.project:
+        os.environ["FIRESTORE_PROJECT"] = args.project
+
+    from db import DBclient
+
+    db = DBclient()
+    checkpoint = {} if args.restart else load_checkpoint(args.checkpoint)
+    if args.workers:
+        threads = max(1, (os.cpu_count() or 1) // args.workers)
+        # spawn, so workers don't inherit this process's Firestore and gRPC state
+        pool = ProcessPoolExecutor(
+            args.workers, mp_context=multiprocessing.get_context("spawn"), initializer=init_worker, initargs=(args.engine, threads)
+        )
+    else:
+        pool = ThreadPoolExecutor(1, initializer=init_worker, initargs=(args.engine, 0))
+
+    try:
+        for source in args.sources:
+            backfill(db, pool, source, args, checkpoint)
+        if args.rollups:
+            rebuild_rollups(db, args)
+    finally:
+        pool.shutdown(cancel_futures=True)
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+# shared with the app's job queue, whose per-modality concurrency has to be at least this to ever fill a batch
+TEXT_BATCH_SIZE = int(os.getenv("TEXT_BATCH_SIZE", 16))
+IMAGE_BATCH_SIZE = int(os.getenv("IMAGE_BATCH_SIZE", 8))
+
+
+class MicroBatcher:
+    """
+    Gathers concurrent calls into one batched call of `fn(items) -> results`.
+    A batch is dispatched when it reaches `max_batch_size` or when the oldest item has waited `max_wait_ms`.
+    """
+
+    def __init__(self, fn, max_batch_size=16, max_wait_ms=10, name="batcher", history=1000):
+        self.fn = fn
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.batches = deque(maxlen=history)
+        self.worker = threading.Thread(target=self.run, name=name, daemon=True)
+        self.worker.start()
+
+    def submit(self, item) -> Future:
+        future = Future()
+        self.queue.put((item, future, time.perf_counter()))
+        return future
+
+    def __call__(self, item):
+        return self.submit(item).result()
+
+    def collect(self):
+        batch = [self.queue.get()]
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.collect()
+            depth = self.queue.qsize()
+            start = time.perf_counter()
+            try:
+                results = check_results(self.name, batch, self.fn([item for item, _, _ in batch]))
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            end = time.perf_counter()
+
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+            self.batches.append(
+                dict(
+                    size=len(batch),
+                    wait_ms=max((start - enqueued) * 1000 for _, _, enqueued in batch),
+                    latency_ms=(end - start) * 1000,
+                    queue_depth=depth,
+                )
+            )
+
+    def stats(self) -> dict:
+        return batch_stats(self.name, self.batches, self.queue.qsize(), self.max_batch_size, self.max_wait)
+
+
+class AsyncMicroBatcher:
+    """
+    Event-loop counterpart of MicroBatcher for async `fn(items) -> results`, e.g. upstream API calls.
+    """
+
+    def __init__(self, fn, max_batch_size=32, max_wait_ms=20, name="batcher", history=1000):
+        self.fn = fn
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.pending = []
+        self.timer = None
+        self.tasks = set()
+        self.batches = deque(maxlen=history)
+
+    async def __call__(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((item, future, time.perf_counter()))
+        if len(self.pending) >= self.max_batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_wait, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.ensure_future(self.run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run(self, batch):
+        start = time.perf_counter()
+        try:
+            results = check_results(self.name, batch, await self.fn([item for item, _, _ in batch]))
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        end = time.perf_counter()
+
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+        self.batches.append(
+            dict(
+                size=len(batch),
+                wait_ms=max((start - enqueued) * 1000 for _, _, enqueued in batch),
+                latency_ms=(end - start) * 1000,
+                queue_depth=len(self.pending),
+            )
+        )
+
+    def stats(self) -> dict:
+        return batch_stats(self.name, self.batches, len(self.pending), self.max_batch_size, self.max_wait)
+
+
+def check_results(name, batch, results):
+    # a short result list would leave the unmatched callers waiting forever, so fail the whole batch instead
+    results = list(results)
+    if len(results) != len(batch):
+        raise RuntimeError(f"{name} returned {len(results)} results for a batch of {len(batch)}")
+    return results
+
+
+def batch_stats(name, batches, queue_depth, max_batch_size, max_wait) -> dict:
+    batches = list(batches)
+    if not batches:
+        return dict(name=name, batches=0, queue_depth=queue_depth)
+
+    latencies = sorted(b["latency_ms"] for b in batches)
+    return dict(
+        name=name,
+        batches=len(batches),
+        items=sum(b["size"] for b in batches),
+        max_batch_size=max_batch_size,
+        max_wait_ms=max_wait * 1000,
+        mean_batch_size=sum(b["size"] for b in batches) / len(batches),
+        mean_wait_ms=sum(b["wait_ms"] for b in batches) / len(batches),
+        max_wait_observed_ms=max(b["wait_ms"] for b in batches),
+        mean_latency_ms=sum(latencies) / len(latencies),
+        p95_latency_ms=latencies[int(0.95 * (len(latencies) - 1))],
+        queue_depth=queue_depth,
+        max_queue_depth=max(b["queue_depth"] for b in batches),
+    )
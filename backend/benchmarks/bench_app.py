@@ -0,0 +1,474 @@
+"""
+End-to-end benchmark of app.py that runs fully offline.
+
+The app is served by uvicorn in this process with stand-ins for everything outside it:
+- FakeFirestore for DBclient
+- a local OpenAI-compatible server for chat, vision, streaming and moderation
+- a fake language_v1 client for document sentiment
+- the saved practo fixture instead of Chrome
+
+Each endpoint is driven alone and then all together at a fixed request rate, and the run reports
+latency percentiles, throughput and peak RSS as JSON. The local models are real unless --models stub
+is passed, in which case fixed-cost stand-ins replace them.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import numpy as np
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+EMOTIONS = ["sadness", "surprise", "joy", "neutral", "anger", "fear", "disgust"]
+TEXT_LABELS = ["anger", "disgust", "fear", "joy", "neutral", "sadness", "surprise"]
+AUDIO_LABELS = ["angry", "disgust", "fearful", "happy", "neutral", "sad", "surprised"]
+SAMPLES = [
+    "I finally finished the project and I feel so proud of myself.",
+    "Nobody texted me back today, I guess nobody really cares.",
+    "My heart was pounding the whole time before the interview.",
+    "Spent the evening reading by the window, calm and content.",
+    "I'm so angry I could scream, they lied to my face again.",
+    "I keep worrying that something bad will happen to my family.",
+]
+CITIES = ["Hyderabad", "Bangalore", "Mumbai", "Delhi", "Chennai", "Pune"]
+ENDPOINTS = ["reflect", "note", "post", "image", "audio", "therapists"]
+
+
+def serve_openai(latency_ms, chunks=8):
+    """OpenAI-compatible chat completions (plain, JSON and streamed) and moderations on localhost."""
+
+    class OpenAIHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def reply(self, body):
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            time.sleep(latency_ms / 1000)
+            if self.path.endswith("/moderations"):
+                inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+                results = [{"flagged": False, "categories": {}, "category_scores": {}} for _ in inputs]
+                return self.reply({"id": "modr", "model": body.get("model", "moderation"), "results": results})
+
+            if body.get("response_format", {}).get("type") in ("json_object", "json_schema"):
+                weights = [random.random() for _ in EMOTIONS]
+                scores = {e: round(100 * w / sum(weights)) for e, w in zip(EMOTIONS, weights)}
+                content = json.dumps(scores | {"remarks": "A person sitting at a desk facing the camera."})
+            else:
+                content = "That sounds like a lot to carry. What do you think would help you feel a little lighter today?"
+
+            if not body.get("stream"):
+                message = {"role": "assistant", "content": content}
+                return self.reply(
+                    {"id": "chat", "object": "chat.completion", "created": 0, "model": body["model"], "choices": [{"index": 0, "finish_reason": "stop", "message": message}]}
+                )
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            size = max(1, len(content) // chunks)
+            for i in range(0, len(content), size):
+                delta = {"index": 0, "delta": {"content": content[i : i + size]}, "finish_reason": None}
+                chunk = {"id": "chat", "object": "chat.completion.chunk", "created": 0, "model": body["model"], "choices": [delta]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OpenAIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class FakeLanguageClient:
+    def __init__(self, latency_ms):
+        self.latency = latency_ms / 1000
+
+    def analyze_sentiment(self, document):
+        time.sleep(self.latency)
+        return SimpleNamespace(document_sentiment=SimpleNamespace(score=random.uniform(-1, 1)))
+
+
+class StubTokenizer:
+    """One token per whitespace-separated word, enough for the analyzer's chunking."""
+
+    def __call__(self, text, add_special_tokens=False, return_offsets_mapping=True):
+        return {"offset_mapping": [match.span() for match in re.finditer(r"\S+", text)]}
+
+
+class StubTextModel:
+    """Stands in for the text-classification pipeline at a fixed cost per batch."""
+
+    def __init__(self, batch_ms):
+        self.batch_ms = batch_ms
+        self.tokenizer = StubTokenizer()
+
+    def __call__(self, texts, batch_size=None, truncation=True):
+        time.sleep(self.batch_ms / 1000)
+        return [[{"label": label, "score": 1 / len(TEXT_LABELS)} for label in TEXT_LABELS] for _ in texts]
+
+
+class StubFeatureExtractor:
+    sampling_rate = 16000
+
+    def __call__(self, windows, **kwargs):
+        import torch
+
+        return {"input_features": torch.zeros(len(windows), 1)}
+
+
+class StubAudioModel:
+    def __init__(self, window_ms):
+        self.window_ms = window_ms
+        self.config = SimpleNamespace(id2label=dict(enumerate(AUDIO_LABELS)))
+
+    def __call__(self, input_features):
+        import torch
+
+        time.sleep(self.window_ms * len(input_features) / 1000)
+        return SimpleNamespace(logits=torch.zeros(len(input_features), len(AUDIO_LABELS)))
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class RSSSampler:
+    """Peak resident memory of this process (server and load generator together) while in use."""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = 0.0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, rss_mb())
+
+    def __enter__(self):
+        self.peak = rss_mb()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, rss_mb())
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]  # noqa: E731
+    return {"p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "mean_ms": sum(values) / len(values)}
+
+
+def summarize(samples, seconds):
+    ok = [s for s in samples if s["status"] < 400]
+    summary = {
+        "requests": len(samples),
+        "errors": sum(1 for s in samples if s["status"] >= 400 and s["status"] != 429),
+        "rejected": sum(1 for s in samples if s["status"] == 429),
+        "throughput_rps": len(ok) / seconds,
+    } | percentiles([s["latency_ms"] for s in ok])
+    jobs = [s for s in ok if "job_ms" in s]
+    if jobs:
+        summary["job"] = {"completed": len(jobs), "failed": sum(1 for s in jobs if s["job_status"] != "done")} | percentiles([s["job_ms"] for s in jobs])
+        summary["job"]["throughput_rps"] = len(jobs) / seconds
+    return summary
+
+
+def make_image(rng):
+    from PIL import Image
+
+    frame = io.BytesIO()
+    Image.fromarray(rng.integers(0, 255, (480, 640, 3), dtype=np.uint8)).save(frame, format="JPEG", quality=80)
+    return frame.getvalue()
+
+
+def make_audio(rng, seconds, sampling_rate=16000):
+    t = np.arange(int(seconds * sampling_rate)) / sampling_rate
+    signal = 0.3 * np.sin(2 * np.pi * rng.uniform(120, 300) * t) + 0.02 * rng.standard_normal(len(t))
+    clip = io.BytesIO()
+    with wave.open(clip, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sampling_rate)
+        f.writeframes((signal * 32767).astype(np.int16).tobytes())
+    return clip.getvalue()
+
+
+class Workload:
+    def __init__(self, app, store, args):
+        self.app = app
+        self.store = store
+        self.args = args
+        self.rng = np.random.default_rng(args.seed)
+        self.counter = 0
+        self.audio = make_audio(self.rng, args.audio_seconds)
+
+    def text(self):
+        self.counter += 1
+        # unique per request so the result cache doesn't turn the run into a cache benchmark
+        return f"{random.choice(SAMPLES)} ({self.counter})"
+
+    def request(self, name):
+        user = f"bench-user-{random.randrange(self.args.users)}"
+        if name == "reflect":
+            return dict(method="POST", url="/reflect", params=dict(prompt=self.text(), user_id=user))
+        if name == "note":
+            note_id = f"note-{self.counter}"
+            self.store.write(f"users/{user}/journal/{note_id}", {"content": self.text(), "userId": user}, merge=False)
+            return dict(method="POST", url="/analyze_note", params=dict(user_id=user, note_id=note_id))
+        if name == "post":
+            post_id = f"post-{self.counter}"
+            self.store.write(f"forum/bench-room/messages/{post_id}", {"content": self.text(), "uid": user}, merge=False)
+            return dict(method="POST", url="/analyze_post", params=dict(room_id="bench-room", post_id=post_id))
+        if name == "image":
+            files = {"file": ("frame.jpg", make_image(self.rng), "image/jpeg")}
+            return dict(method="POST", url="/analyze_image", params=dict(user_id=user), files=files)
+        if name == "audio":
+            return dict(method="POST", url="/analyze_audio", params=dict(user_id=user), files={"file": ("clip.wav", self.audio, "audio/wav")})
+        if name == "therapists":
+            # mostly seeded cities, some unknown ones to exercise the background refresh
+            city = random.choice(CITIES) if random.random() < 0.9 else f"Town{random.randrange(1000)}"
+            return dict(method="POST", url="/therapists", json={"city": city})
+        raise ValueError(name)
+
+    async def job(self, job_id, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = self.app.jobs.get(job_id)
+            if job is not None and job.status in ("done", "failed"):
+                return job
+            await asyncio.sleep(0.005)
+        return None
+
+    async def call(self, client, name):
+        request = self.request(name)
+        started = time.time()
+        try:
+            response = await client.request(**request)
+            status = response.status_code
+        except Exception:
+            return {"endpoint": name, "status": 599, "latency_ms": (time.time() - started) * 1000}
+        sample = {"endpoint": name, "status": status, "latency_ms": (time.time() - started) * 1000}
+        body = response.json() if status < 400 else {}
+        if isinstance(body, dict) and "job_id" in body:
+            job = await self.job(body["job_id"], self.args.job_timeout)
+            if job is None:
+                sample |= {"job_status": "timeout", "job_ms": self.args.job_timeout * 1000}
+            else:
+                sample |= {"job_status": job.status, "job_ms": (job.finished - started) * 1000}
+        return sample
+
+    async def drive(self, client, names, weights, rate, duration):
+        # open loop: requests go out on schedule whether or not earlier ones have finished
+        tasks = []
+        start = time.perf_counter()
+        next_at = start
+        while next_at - start < duration:
+            tasks.append(asyncio.create_task(self.call(client, random.choices(names, weights)[0])))
+            next_at += random.expovariate(rate) if self.args.poisson else 1 / rate
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+        samples = await asyncio.gather(*tasks)
+        return samples, time.perf_counter() - start
+
+
+def micro(analyzer, args):
+    """Model-only timings, called directly on the Analyzer without HTTP, queues or storage."""
+    rng = np.random.default_rng(args.seed)
+    results = {}
+
+    latencies = []
+    start = time.perf_counter()
+    for i in range(args.micro_repeat):
+        began = time.perf_counter()
+        analyzer.analyze(f"{SAMPLES[i % len(SAMPLES)]} [micro {i} {random.random()}]")
+        latencies.append((time.perf_counter() - began) * 1000)
+    results["analyze"] = {"calls": len(latencies), "throughput_rps": len(latencies) / (time.perf_counter() - start)} | percentiles(latencies)
+
+    sampling_rate = analyzer.sampling_rate
+    for seconds in args.micro_audio:
+        t = np.arange(int(seconds * sampling_rate)) / sampling_rate
+        clip = (0.3 * np.sin(2 * np.pi * rng.uniform(120, 300) * t)).astype(np.float32)
+        latencies = []
+        for _ in range(max(1, args.micro_repeat // 4)):
+            began = time.perf_counter()
+            analyzer.analyze_audio(clip)
+            latencies.append((time.perf_counter() - began) * 1000)
+        results[f"analyze_audio_{seconds:g}s"] = {"calls": len(latencies), "realtime_factor": percentiles(latencies)["p50_ms"] / 1000 / seconds} | percentiles(
+            latencies
+        )
+    return results
+
+
+def setup(args, workdir):
+    os.environ["CACHE_PATH"] = os.path.join(workdir, "cache.sqlite")
+    os.environ["OPENAI_KEY"] = "offline-benchmark"
+    os.environ.pop("MODEL_SERVER", None)
+    os.environ.pop("PRELOAD", None)
+    openai_server = serve_openai(args.openai_ms)
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{openai_server.server_port}/v1"
+    os.chdir(workdir)
+
+    import models
+    from bench_parser import FIXTURE, load_cards
+    from db import DBclient
+    from directory import TherapistDirectory
+    from fake_firestore import AsyncFakeFirestore, FakeFirestore
+    from scraper import create_dict
+
+    models.load_language_client = lambda: FakeLanguageClient(args.language_ms)
+    if args.models == "stub":
+        models.load_text_model = lambda engine="torch", model_id=None: StubTextModel(args.stub_text_ms)
+        models.load_emotion_model = lambda engine="torch": (StubAudioModel(args.stub_audio_ms), StubFeatureExtractor())
+
+    import app
+
+    store = FakeFirestore()
+    app.db.factory = lambda: DBclient(store, AsyncFakeFirestore(store))
+
+    cards = load_cards(FIXTURE)
+
+    def fetch(city, gender):
+        time.sleep(args.scrape_ms / 1000)
+        return create_dict(cards, gender)
+
+    app.directory = TherapistDirectory(fetch, path=os.path.join(workdir, "therapists.json"), seed=os.path.join(BACKEND, "data.json"), workers=2)
+    return app, store, openai_server
+
+
+def serve(app):
+    import socket
+
+    import uvicorn
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app.app, host="127.0.0.1", port=port, log_level="warning", timeout_keep_alive=60))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}"
+
+
+async def run(app, store, base_url, args):
+    import httpx
+
+    workload = Workload(app, store, args)
+    mix = dict(item.split("=") for item in args.mix.split(",")) if args.mix else {name: 1 for name in args.endpoints}
+    results = {}
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.job_timeout, limits=httpx.Limits(max_connections=256)) as client:
+        # one request per endpoint first, so lazy loading and first-call setup stay out of the numbers
+        await asyncio.gather(*(workload.call(client, name) for name in args.endpoints))
+        phases = [(name, [name], [1]) for name in args.endpoints] if args.per_endpoint else []
+        phases.append(("mixed", list(mix), [float(w) for w in mix.values()]))
+        for phase, names, weights in phases:
+            with RSSSampler() as rss:
+                samples, seconds = await workload.drive(client, names, weights, args.rate, args.duration)
+            per_endpoint = {name: summarize([s for s in samples if s["endpoint"] == name], seconds) for name in names}
+            results[phase] = {"seconds": seconds, "peak_rss_mb": rss.peak, "overall": summarize(samples, seconds), "endpoints": per_endpoint}
+            print(f"{phase}: {len(samples)} requests in {seconds:.1f}s, peak RSS {rss.peak:.0f} MB", file=sys.stderr)
+    return results
+
+
+def report(results):
+    print(f"{'phase':>10} {'endpoint':>18} {'reqs':>6} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'job p50':>9} {'job p95':>9} {'job p99':>9} {'rss MB':>7}")
+    for phase, result in results["load"].items():
+        for name, s in result["endpoints"].items():
+            job = s.get("job", {})
+            cells = [s.get("p50_ms"), s.get("p95_ms"), s.get("p99_ms"), job.get("p50_ms"), job.get("p95_ms"), job.get("p99_ms")]
+            cells = [f"{c:8.1f}" if c is not None else f"{'-':>8}" for c in cells]
+            print(f"{phase:>10} {name:>18} {s['requests']:>6} {s['throughput_rps']:7.1f} {' '.join(cells[:3])}  {'  '.join(cells[3:])} {result['peak_rss_mb']:7.0f}")
+    for name, s in results.get("micro", {}).items():
+        print(f"{'micro':>10} {name:>18} {s['calls']:>6} {'':>7} {s['p50_ms']:8.1f} {s['p95_ms']:8.1f} {s['p99_ms']:8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline load test of the FastAPI backend against local fakes")
+    parser.add_argument("--rate", type=float, default=20, help="requests per second in each phase")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per phase")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument("--mix", help="weights for the mixed phase, e.g. reflect=4,note=2,image=2,audio=1,post=1,therapists=2")
+    parser.add_argument("--no-per-endpoint", dest="per_endpoint", action="store_false", help="only run the mixed phase")
+    parser.add_argument("--poisson", action="store_true", help="exponential inter-arrival times instead of a fixed interval")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--audio-seconds", type=float, default=10)
+    parser.add_argument("--job-timeout", type=float, default=120)
+    parser.add_argument("--models", choices=["real", "stub"], default="real", help="stub replaces the local models with fixed-cost stand-ins")
+    parser.add_argument("--stub-text-ms", type=float, default=15)
+    parser.add_argument("--stub-audio-ms", type=float, default=200, help="per 30 s window")
+    parser.add_argument("--openai-ms", type=float, default=300, help="simulated upstream latency")
+    parser.add_argument("--language-ms", type=float, default=80, help="simulated Google NL latency")
+    parser.add_argument("--scrape-ms", type=float, default=2000, help="simulated time to scrape one city")
+    parser.add_argument("--micro-repeat", type=int, default=40, help="calls per model microbenchmark, 0 to skip them")
+    parser.add_argument("--micro-audio", type=float, nargs="+", default=[5, 30, 60], help="clip lengths in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the JSON results here")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's own logging")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    workdir = tempfile.mkdtemp(prefix="mindscape-bench-")
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with quiet:
+        started = time.perf_counter()
+        app, store, openai_server = setup(args, workdir)
+        import_s = time.perf_counter() - started
+        server, base_url = serve(app)
+        app.analyzer.prewarm()
+        load_s = time.perf_counter() - started - import_s
+
+        results = {
+            "config": vars(args) | {"workdir": workdir},
+            "startup": {"import_s": import_s, "model_load_s": load_s, "rss_mb": rss_mb()},
+            "load": asyncio.run(run(app, store, base_url, args)),
+        }
+        if args.micro_repeat:
+            results["micro"] = micro(app.analyzer.get(), args)
+        results["app_stats"] = {"jobs": app.jobs.stats(), "llm": dict(app.gateway.stats), "cache": app.result_cache.stats()}
+        results["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        server.should_exit = True
+        openai_server.shutdown()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        report(results)
@@ -0,0 +1,176 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import OnnxClassifier, OnnxTextClassifier, audio_artifact, text_artifact  # noqa: E402
+
+SAMPLES = [
+    "I finally finished the project and I feel so proud of myself.",
+    "Nobody texted me back today, I guess nobody really cares.",
+    "My heart was pounding the whole time before the interview.",
+    "I can't believe they cancelled the trip without telling me!",
+    "Just another ordinary day, went to work and came home.",
+    "The way he spoke to me was disgusting and humiliating.",
+    "I'm so angry I could scream, they lied to my face again.",
+    "Woke up to a surprise party from my friends, I had no idea!",
+    "I keep worrying that something bad will happen to my family.",
+    "Spent the evening reading by the window, calm and content.",
+    "Lost my grandmother last week and the house feels empty.",
+    "Honestly I don't know how I feel about any of this anymore.",
+]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[int(q * (len(values) - 1))]
+
+
+def timed(fn, batches, repeat):
+    latencies, outputs = [], []
+    for i in range(repeat):
+        for batch in batches:
+            start = time.perf_counter()
+            output = fn(batch)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if i == 0:
+                outputs.append(output)
+    return torch.cat(outputs), {"p50_ms": percentile(latencies, 0.5), "p95_ms": percentile(latencies, 0.95)}
+
+
+def agreement(reference, candidate):
+    diff = (reference - candidate).abs()
+    return {
+        "top1_agreement": (reference.argmax(-1) == candidate.argmax(-1)).float().mean().item(),
+        "max_abs_diff": diff.max().item(),
+        "mean_abs_diff": diff.mean().item(),
+    }
+
+
+def artifact_bytes(path):
+    return sum(os.path.getsize(p) for p in (path, path + ".data") if os.path.exists(p))
+
+
+def torch_bytes(model):
+    return sum(p.numel() * p.element_size() for p in model.parameters())
+
+
+def report(torch_stats, onnx_stats, reference, candidate, fp32_bytes, int8_bytes):
+    return {
+        "torch": torch_stats,
+        "onnx_int8": onnx_stats,
+        "speedup_p50": torch_stats["p50_ms"] / onnx_stats["p50_ms"],
+        "fp32_mb": fp32_bytes / 1024**2,
+        "int8_mb": int8_bytes / 1024**2,
+    } | agreement(reference, candidate)
+
+
+def bench_text(model_id, texts, batch_size, repeat):
+    from transformers import pipeline
+
+    reference_model = pipeline("text-classification", model=model_id, top_k=None)
+    path = text_artifact(model_id)
+    onnx_model = OnnxTextClassifier(model_id, path)
+    labels = list(reference_model.model.config.id2label.values())
+    batches = [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
+
+    def scores(model):
+        def run(batch):
+            results = model(batch, batch_size=len(batch), truncation=True)
+            return torch.tensor([[{e["label"]: e["score"] for e in emotions}[label] for label in labels] for emotions in results])
+
+        return run
+
+    reference, torch_stats = timed(scores(reference_model), batches, repeat)
+    candidate, onnx_stats = timed(scores(onnx_model), batches, repeat)
+    return report(torch_stats, onnx_stats, reference, candidate, torch_bytes(reference_model.model), artifact_bytes(path))
+
+
+def bench_audio(model_id, clips, batch_size, repeat):
+    from transformers import AutoFeatureExtractor, AutoModelForAudioClassification
+
+    feature_extractor = AutoFeatureExtractor.from_pretrained(model_id, do_normalize=True)
+    reference_model = AutoModelForAudioClassification.from_pretrained(model_id).eval()
+    path = audio_artifact(model_id, feature_extractor)
+    onnx_model = OnnxClassifier(path, reference_model.config)
+
+    # same padding as Analyzer.classify_windows
+    fixed_length = getattr(feature_extractor, "n_samples", None)
+    padding = dict(padding="max_length", max_length=fixed_length, truncation=True) if fixed_length else dict(padding="longest")
+    batches = [
+        feature_extractor(clips[i : i + batch_size], sampling_rate=feature_extractor.sampling_rate, return_tensors="pt", **padding)
+        for i in range(0, len(clips), batch_size)
+    ]
+
+    def scores(model):
+        def run(inputs):
+            with torch.no_grad():
+                return torch.softmax(model(**inputs).logits, dim=-1)
+
+        return run
+
+    reference, torch_stats = timed(scores(reference_model), batches, repeat)
+    candidate, onnx_stats = timed(scores(onnx_model), batches, repeat)
+    return report(torch_stats, onnx_stats, reference, candidate, torch_bytes(reference_model), artifact_bytes(path))
+
+
+def load_clips(paths, sampling_rate, seconds=(5, 15, 30)):
+    if paths:
+        import librosa
+
+        return [librosa.load(path, sr=sampling_rate)[0] for path in paths]
+    # no recordings given: tones over noise at the window lengths Analyzer.split_audio produces
+    rng = np.random.default_rng(0)
+    clips = []
+    for length in seconds:
+        t = np.arange(length * sampling_rate) / sampling_rate
+        clips.append((0.3 * np.sin(2 * np.pi * rng.uniform(100, 400) * t) + 0.05 * rng.standard_normal(len(t))).astype(np.float32))
+    return clips
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the int8 ONNX Runtime engine with the PyTorch models")
+    parser.add_argument("--text-model", help="defaults to models.TEXT_MODEL")
+    parser.add_argument("--audio-model", help="defaults to models.AUDIO_MODEL")
+    parser.add_argument("--texts", help="file with one text per line, defaults to built-in journal samples")
+    parser.add_argument("--audio", nargs="*", help="audio files, defaults to synthetic clips")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip", choices=["text", "audio"], action="append", default=[])
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    if not (args.text_model and args.audio_model):
+        from models import AUDIO_MODEL, TEXT_MODEL
+
+        args.text_model = args.text_model or TEXT_MODEL
+        args.audio_model = args.audio_model or AUDIO_MODEL
+
+    results = {}
+    if "text" not in args.skip:
+        texts = [line.strip() for line in open(args.texts, encoding="utf-8") if line.strip()] if args.texts else SAMPLES
+        results["text"] = bench_text(args.text_model, texts, args.batch_size, args.repeat) | {"model": args.text_model, "items": len(texts)}
+    if "audio" not in args.skip:
+        from transformers import AutoFeatureExtractor
+
+        sampling_rate = AutoFeatureExtractor.from_pretrained(args.audio_model).sampling_rate
+        clips = load_clips(args.audio, sampling_rate)
+        results["audio"] = bench_audio(args.audio_model, clips, args.batch_size, args.repeat) | {"model": args.audio_model, "items": len(clips)}
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        for name, result in results.items():
+            print(f"{name}: {result['model']} ({result['items']} inputs, batch size {args.batch_size})")
+            print(f"{'torch fp32':>16}: p50 {result['torch']['p50_ms']:8.1f} ms  p95 {result['torch']['p95_ms']:8.1f} ms  {result['fp32_mb']:8.1f} MB")
+            print(f"{'onnx int8':>16}: p50 {result['onnx_int8']['p50_ms']:8.1f} ms  p95 {result['onnx_int8']['p95_ms']:8.1f} ms  {result['int8_mb']:8.1f} MB")
+            print(
+                f"{'':>16}  {result['speedup_p50']:.2f}x faster, top-1 agreement {result['top1_agreement']:.1%}, "
+                f"max |dp| {result['max_abs_diff']:.4f}, mean |dp| {result['mean_abs_diff']:.5f}"
+            )
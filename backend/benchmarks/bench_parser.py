@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraper import PARSERS, create_dict, create_dict_bs4  # noqa: E402
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fixtures", "practo.html")
+
+
+def load_cards(path):
+    # the same innerHTML strings Scraper.scrape_website returns for each info-section div
+    from bs4 import BeautifulSoup
+
+    with open(path, encoding="utf-8") as f:
+        soup = BeautifulSoup(f.read(), "html.parser")
+    return [div.decode_contents() for div in soup.find_all("div", class_="info-section")]
+
+
+def measure(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def available(parser):
+    try:
+        list(PARSERS[parser]("<div></div>"))
+        return True
+    except ImportError:
+        return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare create_dict parser backends on saved listing pages")
+    parser.add_argument("--fixture", default=FIXTURE)
+    parser.add_argument("--scale", type=int, default=20, help="repeat the fixture cards to simulate a large city")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    cards = load_cards(args.fixture) * args.scale
+    expected = create_dict_bs4(cards, "male")
+
+    results = {"cards": len(cards)}
+    baseline = measure(lambda: create_dict_bs4(cards, "male"), args.repeat)
+    results["create_dict_bs4"] = {"seconds": baseline, "cards_per_s": len(cards) / baseline, "speedup": 1.0}
+
+    for name in PARSERS:
+        if not available(name):
+            results[name] = None
+            continue
+        output = create_dict(cards, "male", parser=name)
+        assert output == expected, f"{name} output differs from create_dict_bs4"
+        # a failed scrape yields no cards
+        assert create_dict([], "male", parser=name) == create_dict_bs4([], "male") == [], f"{name} mishandles an empty page"
+        seconds = measure(lambda: create_dict(cards, "male", parser=name), args.repeat)
+        results[name] = {"seconds": seconds, "cards_per_s": len(cards) / seconds, "speedup": baseline / seconds}
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        print(f"{results.pop('cards')} cards")
+        for name, result in results.items():
+            if result is None:
+                print(f"{name:>16}: not installed")
+            else:
+                print(f"{name:>16}: {result['seconds'] * 1000:8.1f} ms  {result['cards_per_s']:10.0f} cards/s  {result['speedup']:5.1f}x")
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+
+
+def content_key(namespace, version, content) -> str:
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    digest = hashlib.sha256(content).hexdigest()
+    return f"{namespace}:{version}:{digest}"
+
+
+class ResultCache:
+    """
+    Analysis results keyed by a hash of their input and the model version that produced them.
+    A small in-memory LRU sits in front of an SQLite file; both tiers evict least-recently-used
+    entries once their total size passes the configured byte limits. Every process shares the file,
+    so its size is read from SQLite's own page counts rather than tracked per process.
+    Values hold scores and spans only, never the analyzed text.
+    """
+
+    # bumped when stored values change shape; older rows are purged on open
+    SCHEMA_VERSION = 1
+
+    def __init__(self, path="cache.sqlite", memory_bytes=16 * 1024**2, disk_bytes=512 * 1024**2):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.memory = OrderedDict()
+        self.memory_size = 0
+        self.stats_counter = Counter()
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, namespace TEXT, version TEXT, value TEXT, size INTEGER, accessed REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] < self.SCHEMA_VERSION:
+            # earlier versions kept journal sentences and image remarks in plain text
+            self.db.execute("DELETE FROM results WHERE namespace IN ('analyze+sentences', 'analyze_image')")
+            self.db.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    @property
+    def disk_size(self):
+        # bytes in use by the file across all processes, excluding pages freed by deletes
+        page_count, free, page_size = (self.db.execute(f"PRAGMA {name}").fetchone()[0] for name in ("page_count", "freelist_count", "page_size"))
+        return (page_count - free) * page_size
+
+    def remember(self, key, value, size):
+        if key in self.memory:
+            self.memory_size -= self.memory.pop(key)[1]
+        self.memory[key] = (value, size)
+        self.memory_size += size
+        while self.memory_size > self.memory_bytes and self.memory:
+            _, (_, evicted) = self.memory.popitem(last=False)
+            self.memory_size -= evicted
+            self.stats_counter["memory_evictions"] += 1
+
+    def get(self, namespace, version, content):
+        key = content_key(namespace, version, content)
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.stats_counter[f"{namespace}.memory_hits"] += 1
+                return json.loads(self.memory[key][0])
+
+            row = self.db.execute("SELECT value, size FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats_counter[f"{namespace}.misses"] += 1
+                return None
+            self.db.execute("UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key))
+            self.remember(key, *row)
+            self.stats_counter[f"{namespace}.disk_hits"] += 1
+            return json.loads(row[0])
+
+    def set(self, namespace, version, content, result):
+        key = content_key(namespace, version, content)
+        value = json.dumps(result)
+        size = len(value)
+        with self.lock:
+            self.remember(key, value, size)
+            self.db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (key, namespace, str(version), value, size, time.time()),
+            )
+            if self.disk_size > self.disk_bytes:
+                self.evict()
+        return result
+
+    def evict(self, chunk=256):
+        # drop the oldest entries until the file is back to 90% of its budget; the write lock keeps
+        # other processes from evicting the same rows at the same time
+        target = int(self.disk_bytes * 0.9)
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            while self.disk_size > target:
+                deleted = self.db.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed LIMIT ?)", (chunk,)
+                ).rowcount
+                if not deleted:
+                    break
+                self.stats_counter["disk_evictions"] += deleted
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+
+    def stats(self) -> dict:
+        return dict(self.stats_counter) | {
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory_size,
+            "disk_bytes": self.disk_size,
+        }
+
+
+result_cache = ResultCache(os.getenv("CACHE_PATH", "cache.sqlite"))
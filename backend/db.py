@@ -1,17 +1,180 @@
+import asyncio
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+from collections import Counter
+
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials, firestore, firestore_async
+from google.api_core import exceptions
+from google.cloud.firestore_v1.async_transaction import async_transactional
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.transaction import transactional
+from metrics import registry
+from rollups import rollup_updates, summarize
 
 
 def load_db_client():
+    if os.getenv("FIRESTORE_EMULATOR_HOST"):
+        from google.auth.credentials import AnonymousCredentials
+        from google.cloud.firestore import Client
+
+        return Client(project=os.getenv("FIRESTORE_PROJECT", "mindscape-emulator"), credentials=AnonymousCredentials())
+
     cred = credentials.Certificate("firebase.json")
     firebase_admin.initialize_app(cred)
     client = firestore.client()
     return client
 
 
+def load_async_db_client():
+    if os.getenv("FIRESTORE_EMULATOR_HOST"):
+        from google.auth.credentials import AnonymousCredentials
+        from google.cloud.firestore import AsyncClient
+
+        return AsyncClient(project=os.getenv("FIRESTORE_PROJECT", "mindscape-emulator"), credentials=AnonymousCredentials())
+
+    # reuses the app initialized by load_db_client
+    return firestore_async.client()
+
+
+# commits Firestore rejects before applying anything; a deadline or internal error may have landed,
+# and retrying it would apply the rollup increments twice
+SAFE_TO_RETRY = (exceptions.Aborted, exceptions.ServiceUnavailable, exceptions.ResourceExhausted, exceptions.TooManyRequests)
+
+
+def dead_letter_value(value):
+    # field transforms and timestamps as JSON, so dropped writes can be inspected and replayed by hand
+    if isinstance(value, (firestore.Increment, firestore.Minimum, firestore.Maximum)):
+        return {"$transform": type(value).__name__, "value": value.value}
+    if isinstance(value, firestore.ArrayUnion):
+        return {"$transform": "ArrayUnion", "values": value.values}
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return repr(value)
+
+
+class BatchWriter:
+    """
+    Write-behind buffer that groups writes from any thread into Firestore batch commits.
+    A batch is committed once it holds `max_batch` writes or its oldest write is `flush_interval` seconds old.
+    `add` blocks (and `add_async` waits) while `max_pending` writes are queued.
+    Only commits Firestore certainly rejected are retried. Batches that still fail are appended to
+    `dead_letter` as JSON lines rather than lost.
+    """
+
+    STOP = object()
+
+    def __init__(self, client, max_batch=500, flush_interval=1.0, max_pending=10000, retries=3, dead_letter=None):
+        self.client = client
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.dead_letter = dead_letter or os.getenv("FIRESTORE_DEAD_LETTER", "firestore-dead-letter.jsonl")
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.stats = Counter()
+        self.thread = threading.Thread(target=self.run, name="firestore-writer", daemon=True)
+        self.thread.start()
+
+    def add(self, *writes):
+        # each write is (collection, data) for a new document, (document, data, merge) for a set
+        # or (document, None, False) for a delete
+        for write in writes:
+            self.queue.put(write)
+
+    async def add_async(self, *writes):
+        for write in writes:
+            try:
+                self.queue.put_nowait(write)
+            except queue.Full:
+                self.stats["backpressure"] += 1
+                await asyncio.to_thread(self.queue.put, write)
+
+    def flush(self, timeout=None):
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=None):
+        self.queue.put(self.STOP)
+        self.thread.join(timeout)
+
+    def commit(self, writes):
+        if not writes:
+            return
+        # new documents get their ids once, so a retried batch can't create them twice
+        writes = [(write[0].document(), write[1], False) if len(write) == 2 else write for write in writes]
+        for attempt in range(self.retries):
+            try:
+                batch = self.client.batch()
+                for document, data, merge in writes:
+                    if data is None:
+                        batch.delete(document)
+                    else:
+                        batch.set(document, data, merge=merge)
+                with registry.stage("firestore_commit"):
+                    batch.commit()
+                registry.inc("mindscape_firestore_writes_total", len(writes))
+                self.stats["commits"] += 1
+                self.stats["writes"] += len(writes)
+                return
+            except Exception as e:
+                print(f"Batch commit of {len(writes)} writes failed: {e!r}")
+                error = e
+                if not isinstance(e, SAFE_TO_RETRY):
+                    break
+                time.sleep(0.5 * 2**attempt)
+        self.drop(writes, error)
+
+    def drop(self, writes, error):
+        self.stats["dropped"] += len(writes)
+        registry.inc("mindscape_firestore_dropped_writes_total", len(writes))
+        try:
+            with open(self.dead_letter, "a", encoding="utf-8") as f:
+                for document, data, merge in writes:
+                    record = {"path": document.path, "data": data, "merge": merge, "error": repr(error), "dropped_at": time.time()}
+                    f.write(json.dumps(record, default=dead_letter_value) + "\n")
+            print(f"Dropped {len(writes)} Firestore writes after {error!r}, appended them to {self.dead_letter}")
+        except OSError as e:
+            print(f"Dropped {len(writes)} Firestore writes after {error!r}, and could not save them: {e!r}")
+            for document, data, merge in writes:
+                print(f"  dropped {document.path}: {json.dumps(data, default=dead_letter_value)}")
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            writes, signals = [], []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is self.STOP:
+                    self.commit(writes)
+                    for signal in signals:
+                        signal.set()
+                    return
+                if isinstance(item, threading.Event):
+                    signals.append(item)
+                    break
+                writes.append(item)
+                remaining = deadline - time.monotonic()
+                if len(writes) >= self.max_batch or remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            self.commit(writes)
+            for signal in signals:
+                signal.set()
+
+
 class DBclient:
-    def __init__(self):
-        self.client = load_db_client()
+    def __init__(self, client=None, async_client=None):
+        self.client = client or load_db_client()
+        self._async_client = async_client
+        self.writer = BatchWriter(self.client)
 
     def get_post(self, room_id, reply_id):
         """
@@ -33,22 +196,206 @@ class DBclient:
         note = journal.document(note_id)
         return note.get().to_dict()
 
-    def add_sentiment(self, user_id, sentiment_dict, q=False):
-        prefix = "q_" if q else ""
+    def sentiments(self, user_id, q=False, prefix=None):
+        if prefix is None:
+            prefix = "q_" if q else ""
         collection = f"{prefix}sentiments"
 
         users = self.client.collection("users")
         user = users.document(user_id)
-        sentiments = user.collection(collection)
-        sentiments.add(sentiment_dict)
+        return user.collection(collection)
+
+    @staticmethod
+    def sentiment_id(kind, path):
+        """
+        Fixed sentiment id for a scored journal note or forum post, e.g. 'note-{uid}-{note_id}' for
+        users/{uid}/journal/{note_id}, shared by the app and the backfill so rescoring overwrites.
+        """
+        return f"{kind}-" + "-".join(path.split("/")[1::2])
+
+    def sentiment_writes(self, user_id, sentiment_dict, q=False, prefix=None, document_id=None, previous=None):
+        # the sentiment itself plus its day/week/month rollup changes, queued together
+        if prefix is None:
+            prefix = "q_" if q else ""
+        user = self.client.collection("users").document(user_id)
+        sentiments = self.sentiments(user_id, prefix=prefix)
+        # a fixed document id makes rewriting the same sentiment an overwrite instead of a duplicate
+        writes = [(sentiments.document(document_id), sentiment_dict, False) if document_id else (sentiments, sentiment_dict)]
+        for period, key, data in rollup_updates(sentiment_dict, previous):
+            writes.append((user.collection(f"{prefix}rollups_{period}").document(key), data, True))
+        return writes
+
+    def add_sentiment(self, user_id, sentiment_dict, q=False, document_id=None):
+        if document_id:
+            return self.replace_sentiment(user_id, sentiment_dict, q, document_id)
+        self.writer.add(*self.sentiment_writes(user_id, sentiment_dict, q))
+        return sentiment_dict
+
+    async def add_sentiment_async(self, user_id, sentiment_dict, q=False, document_id=None):
+        if document_id:
+            return await self.replace_sentiment_async(user_id, sentiment_dict, q, document_id)
+        await self.writer.add_async(*self.sentiment_writes(user_id, sentiment_dict, q))
+        return sentiment_dict
+
+    def replace_sentiment(self, user_id, sentiment_dict, q, document_id):
+        """
+        Writes a sentiment under its fixed id in one transaction with its rollups, moving the previous
+        version's share of them to the new one, so rescoring a note or post never counts it twice.
+        """
+        reference = self.sentiments(user_id, q).document(document_id)
+
+        @transactional
+        def replace(transaction):
+            previous = reference.get(transaction=transaction).to_dict()
+            for document, data, merge in self.sentiment_writes(user_id, sentiment_dict, q, document_id=document_id, previous=previous):
+                transaction.set(document, data, merge=merge)
+
+        with registry.stage("firestore_commit"):
+            replace(self.client.transaction())
         return sentiment_dict
 
+    async def replace_sentiment_async(self, user_id, sentiment_dict, q, document_id):
+        client = self.async_client
+        prefix = "q_" if q else ""
+        reference = client.document(f"users/{user_id}/{prefix}sentiments/{document_id}")
+
+        @async_transactional
+        async def replace(transaction):
+            previous = (await reference.get(transaction=transaction)).to_dict()
+            for document, data, merge in self.sentiment_writes(user_id, sentiment_dict, q, document_id=document_id, previous=previous):
+                transaction.set(client.document(document.path), data, merge=merge)
+
+        with registry.stage("firestore_commit"):
+            await replace(client.transaction())
+        return sentiment_dict
+
+    async def get_rollups_async(self, user_id, period, start=None, end=None, q=False):
+        prefix = "q_" if q else ""
+        query = self.async_client.collection(f"users/{user_id}/{prefix}rollups_{period}")
+        if start:
+            query = query.where(filter=FieldFilter("start", ">=", start))
+        if end:
+            query = query.where(filter=FieldFilter("start", "<=", end))
+        query = query.order_by("start")
+        return [summarize(doc.to_dict() | {"id": doc.id}) async for doc in query.stream()]
+
+    def collection_pages(self, collection_id, page_size=500, after=None):
+        """
+        Every document in any collection named `collection_id`, e.g. all users' journals, in pages of
+        `page_size` snapshots ordered by path. `after` is the path of the last document already seen.
+        """
+        query = self.client.collection_group(collection_id).order_by("__name__").limit(page_size)
+        cursor = self.client.document(after).get() if after else None
+        while True:
+            with registry.stage("firestore_read"):
+                page = list((query.start_after(cursor) if cursor is not None else query).stream())
+            if page:
+                yield page
+            if len(page) < page_size:
+                return
+            cursor = page[-1]
+
+    def count(self, collection_id):
+        return self.client.collection_group(collection_id).count().get()[0][0].value
+
+    def close(self):
+        self.writer.close()
+
+    def get_chat_meta(self, user_id: str):
+        """
+        {'count': 42, 'summarized': 30, 'summary': 'The patient has been ...'}
+        """
+        users = self.client.collection("users")
+        user = users.document(user_id).get(field_paths=["chat"]).to_dict() or {}
+        return user.get("chat")
+
+    def get_chat_pages(self, user_id: str, pages):
+        users = self.client.collection("users")
+        chat_pages = users.document(user_id).collection("chat_pages")
+        docs = self.client.get_all([chat_pages.document(f"{page:06d}") for page in pages])
+        docs = sorted((doc for doc in docs if doc.exists), key=lambda doc: doc.id)
+        return [message for doc in docs for message in doc.to_dict().get("messages", [])]
+
+    def get_legacy_messages(self, user_id: str):
+        users = self.client.collection("users")
+        user = users.document(user_id).get(field_paths=["messages"]).to_dict() or {}
+        return user.get("messages", [])
+
     def get_chat_history(self, user_id: str):
         users = self.client.collection("users")
         user = users.document(user_id).get().to_dict()
         messages = user.get("messages", [])
         return self.format_messages(messages)
 
+    # async variants for the FastAPI endpoints, so Firestore round trips don't block the event loop
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            self._async_client = load_async_db_client()
+        return self._async_client
+
+    async def get_document_async(self, path, field_paths=None):
+        with registry.stage("firestore_read"):
+            snapshot = await self.async_client.document(path).get(field_paths=field_paths)
+        return snapshot.to_dict()
+
+    async def get_documents_async(self, paths):
+        # independent reads, run concurrently
+        return await asyncio.gather(*(self.get_document_async(path) for path in paths))
+
+    async def get_post_async(self, room_id, reply_id):
+        return await self.get_document_async(f"forum/{room_id}/messages/{reply_id}")
+
+    async def get_note_async(self, user_id, note_id):
+        return await self.get_document_async(f"users/{user_id}/journal/{note_id}")
+
+    async def get_chat_meta_async(self, user_id: str):
+        user = await self.get_document_async(f"users/{user_id}", field_paths=["chat"]) or {}
+        return user.get("chat")
+
+    async def get_chat_pages_async(self, user_id: str, pages):
+        docs = await self.get_documents_async([f"users/{user_id}/chat_pages/{page:06d}" for page in pages])
+        return [message for doc in docs if doc for message in doc.get("messages", [])]
+
+    async def add_chat_messages_async(self, user_id: str, messages, meta, page_size=50, only_if_new=False):
+        """
+        Appends `messages` after the committed chat count in one transaction and returns the stored meta.
+        Pages are rewritten whole, so concurrent writers never share a slot and repeated turns are kept.
+        With `only_if_new`, nothing is written if the chat already exists, e.g. a legacy import another worker won.
+        `meta` supplies the summary fields; its count is ignored in favour of the stored one.
+        """
+        client = self.async_client
+        user = client.document(f"users/{user_id}")
+
+        @async_transactional
+        async def append(transaction):
+            stored = ((await user.get(field_paths=["chat"], transaction=transaction)).to_dict() or {}).get("chat")
+            if stored is not None and only_if_new:
+                return stored
+            count = stored["count"] if stored else 0
+            pages = range(count // page_size, (count + len(messages) - 1) // page_size + 1) if messages else range(0)
+            references = [client.document(f"users/{user_id}/chat_pages/{page:06d}") for page in pages]
+            snapshots = [await reference.get(transaction=transaction) for reference in references]
+
+            index, remaining = count, list(messages)
+            for page, reference, snapshot in zip(pages, references, snapshots):
+                existing = (snapshot.to_dict() or {}).get("messages") or []
+                space = page_size - (index - page * page_size)
+                chunk, remaining = remaining[:space], remaining[space:]
+                transaction.set(reference, {"page": page, "messages": existing + chunk})
+                index += len(chunk)
+            stored = meta | {"count": count + len(messages)}
+            transaction.set(user, {"chat": stored}, merge=True)
+            return stored
+
+        with registry.stage("firestore_commit"):
+            return await append(client.transaction())
+
+    async def get_legacy_messages_async(self, user_id: str):
+        user = await self.get_document_async(f"users/{user_id}", field_paths=["messages"]) or {}
+        return user.get("messages", [])
+
     def format_messages(self, messages):
         formatted = []
         for message in messages:
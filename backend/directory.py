@@ -0,0 +1,159 @@
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+
+GENDERS = ("male", "female")
+CITY_PATTERN = re.compile(r"[a-z][a-z .-]{0,63}")
+
+
+def parse_int(value):
+    digits = re.sub(r"[^\d]", "", value or "")
+    return int(digits) if digits else None
+
+
+def city_of(entry):
+    location = entry.get("location") or ""
+    return location.split(",")[-1].strip().lower() or None
+
+
+class Index:
+    """
+    Entries for one city/gender in practo's relevance order.
+    A fee-sorted view of their positions turns fee ranges into two bisects.
+    """
+
+    def __init__(self, entries, fetched_at):
+        self.fetched_at = fetched_at
+        self.entries = list(entries)
+        self.by_fee = sorted((e["fee"], i) for i, e in enumerate(self.entries) if e["fee"] is not None)
+        self.fees = [fee for fee, _ in self.by_fee]
+
+    def query(self, min_fee=None, max_fee=None, min_recommendation=None):
+        if min_fee is None and max_fee is None:
+            entries = self.entries
+        else:
+            lo = bisect_left(self.fees, min_fee) if min_fee is not None else 0
+            hi = bisect_right(self.fees, max_fee) if max_fee is not None else len(self.fees)
+            entries = [self.entries[i] for i in sorted(i for _, i in self.by_fee[lo:hi])]
+        if min_recommendation is not None:
+            entries = [e for e in entries if e["recommendation"] is not None and e["recommendation"] >= min_recommendation]
+        return entries
+
+
+class TherapistDirectory:
+    """
+    Persistent therapist listings keyed by city and gender, served from in-memory indexes.
+    Stale or missing keys are refreshed in the background with `fetch(city, gender)`, never on the request path.
+    A refresh that finds nothing, e.g. for a misspelled city, isn't retried for `empty_ttl` seconds.
+    """
+
+    def __init__(self, fetch, path="therapists.json", ttl=24 * 3600, seed="data.json", workers=1, max_pending=16, empty_ttl=3600):
+        self.fetch = fetch
+        self.path = path
+        self.ttl = ttl
+        self.empty_ttl = empty_ttl
+        self.empty = {}
+        # cities come straight from requests, so cap how many scrapes can pile up behind the executor
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        # refreshes finish on several executor threads; one writer at a time keeps therapists.json whole
+        self.save_lock = threading.Lock()
+        self.indexes = {}
+        self.refreshing = set()
+        # each refresh drives a browser, so keep this at or below the scraper's pool size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="directory")
+        self.load(seed)
+
+    def load(self, seed=None):
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                store = json.load(f)
+        elif seed and os.path.exists(seed):
+            with open(seed, encoding="utf-8") as f:
+                listings = json.load(f)
+            fetched_at = os.path.getmtime(seed)
+            store = {}
+            for entry in listings:
+                key = f"{city_of(entry)}/{entry['gender']}"
+                store.setdefault(key, {"fetched_at": fetched_at, "entries": []})["entries"].append(entry)
+        else:
+            store = {}
+
+        for key, value in store.items():
+            self.indexes[key] = self.build(value["entries"], value["fetched_at"])
+
+    def build(self, listings, fetched_at):
+        entries = [
+            {
+                "entry": entry,
+                "fee": parse_int(entry.get("consultation_fee")),
+                "recommendation": parse_int(entry.get("reviews")),
+            }
+            for entry in listings
+        ]
+        return Index(entries, fetched_at)
+
+    def save(self):
+        with self.save_lock:
+            with self.lock:
+                store = {
+                    key: {
+                        "fetched_at": index.fetched_at,
+                        "entries": [e["entry"] for e in index.entries],
+                    }
+                    for key, index in self.indexes.items()
+                }
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(store, f, ensure_ascii=False, indent=4)
+            os.replace(tmp, self.path)
+
+    def refresh(self, city, gender):
+        key = f"{city}/{gender}"
+        try:
+            listings = self.fetch(city, gender)
+            if listings:
+                index = self.build(listings, time.time())
+                with self.lock:
+                    self.indexes[key] = index
+                    self.empty.pop(key, None)
+                self.save()
+            else:
+                now = time.time()
+                with self.lock:
+                    self.empty = {k: t for k, t in self.empty.items() if now - t <= self.empty_ttl}
+                    self.empty[key] = now
+        except Exception as e:
+            print(f"Directory refresh failed for {key}: {e}")
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def schedule_refresh(self, city, gender):
+        key = f"{city}/{gender}"
+        with self.lock:
+            if key in self.refreshing or len(self.refreshing) >= self.max_pending:
+                return
+            if time.time() - self.empty.get(key, 0) <= self.empty_ttl:
+                return
+            self.refreshing.add(key)
+        self.executor.submit(self.refresh, city, gender)
+
+    def get(self, city, genders=GENDERS, min_fee=None, max_fee=None, min_recommendation=None):
+        city = city.strip().lower()
+        if not CITY_PATTERN.fullmatch(city):
+            return []
+        output = []
+        for gender in genders:
+            if gender not in GENDERS:
+                continue
+            index = self.indexes.get(f"{city}/{gender}")
+            if index is None or time.time() - index.fetched_at > self.ttl:
+                self.schedule_refresh(city, gender)
+            if index is not None:
+                output.extend(e["entry"] for e in index.query(min_fee, max_fee, min_recommendation))
+        return output
@@ -0,0 +1,160 @@
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+from transformers import AutoConfig, AutoTokenizer
+
+ENGINES = ("torch", "onnx")
+# bump when the export or quantization settings change so stale artifacts are rebuilt
+EXPORT_VERSION = 2
+ARTIFACTS = os.getenv("ONNX_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "onnx"))
+
+
+class Logits(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, *inputs):
+        return self.model(*inputs).logits
+
+
+def artifact(model_id, load_model, sample_inputs, dynamic_axes, quantize=True, cache_dir=ARTIFACTS):
+    """
+    Path of the (int8) ONNX export of a transformers classifier, exporting and quantizing on first use.
+    `sample_inputs` is an ordered dict of tensors matching the model's forward arguments.
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    variant = "int8" if quantize else "fp32"
+    directory = os.path.join(cache_dir, f"{model_id.replace('/', '--')}-v{EXPORT_VERSION}-{variant}")
+    path = os.path.join(directory, f"model.{variant}.onnx")
+    # a finished artifact only ever appears by renaming its whole directory into place, so it's complete if it exists
+    if os.path.isdir(directory):
+        return path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".export-", dir=cache_dir)
+    try:
+        # torch may spill large weights into files beside the export, so the fp32 model gets its own folder
+        fp32 = os.path.join(staging, "fp32", "model.fp32.onnx") if quantize else os.path.join(staging, "model.fp32.onnx")
+        os.makedirs(os.path.dirname(fp32), exist_ok=True)
+        model = load_model().eval()
+        print(f"exporting {model_id} to {directory}")
+        with torch.no_grad():
+            torch.onnx.export(
+                Logits(model),
+                tuple(sample_inputs.values()),
+                fp32,
+                input_names=list(sample_inputs),
+                output_names=["logits"],
+                dynamic_axes=dynamic_axes | {"logits": {0: "batch"}},
+                opset_version=17,
+                dynamo=False,
+            )
+        del model
+        if quantize:
+            print(f"quantizing {model_id} to int8")
+            # the whisper encoder is past protobuf's 2GB limit, so weights always go to an external file
+            quantize_dynamic(
+                fp32, os.path.join(staging, os.path.basename(path)), weight_type=QuantType.QInt8, use_external_data_format=True
+            )
+            shutil.rmtree(os.path.dirname(fp32))
+        os.chmod(staging, 0o755)  # mkdtemp makes it private
+        try:
+            os.replace(staging, directory)
+        except OSError:
+            # another process finished the same export first; keep theirs
+            if not os.path.isdir(directory):
+                raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return path
+
+
+class OnnxClassifier:
+    """
+    onnxruntime session behind the bits of the transformers model interface Analyzer uses:
+    `config.id2label`, `.to()` and `model(**inputs).logits`.
+    """
+
+    def __init__(self, path, config, threads=0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.config = config
+
+    def to(self, device):
+        return self
+
+    def eval(self):
+        return self
+
+    def __call__(self, **inputs):
+        feed = {name: inputs[name].cpu().numpy() for name in self.input_names}
+        (logits,) = self.session.run(["logits"], feed)
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+
+class OnnxTextClassifier:
+    """Drop-in for the `text-classification` pipeline with `top_k=None`: every label and its softmax score."""
+
+    def __init__(self, model_id, path, threads=0):
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id)
+        self.model = OnnxClassifier(path, AutoConfig.from_pretrained(model_id), threads)
+
+    def __call__(self, texts, batch_size=None, truncation=True):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        batch_size = batch_size or len(texts)
+        id2label = self.model.config.id2label
+
+        results = []
+        for i in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(texts[i : i + batch_size], padding=True, truncation=truncation, return_tensors="pt")
+            probabilities = torch.softmax(self.model(**inputs).logits, dim=-1)
+            for row in probabilities:
+                scores = [{"label": id2label[j], "score": p.item()} for j, p in enumerate(row)]
+                results.append(sorted(scores, key=lambda score: score["score"], reverse=True))
+        return results[0] if single else results
+
+
+def text_artifact(model_id, quantize=True):
+    from transformers import AutoModelForSequenceClassification
+
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    sample = tokenizer(["a sample sentence", "another one"], padding=True, return_tensors="pt")
+    axes = {0: "batch", 1: "tokens"}
+    return artifact(
+        model_id,
+        lambda: AutoModelForSequenceClassification.from_pretrained(model_id),
+        {"input_ids": sample["input_ids"], "attention_mask": sample["attention_mask"]},
+        {"input_ids": axes, "attention_mask": axes},
+        quantize,
+    )
+
+
+def audio_artifact(model_id, feature_extractor, quantize=True):
+    from transformers import AutoModelForAudioClassification
+
+    sample = feature_extractor(
+        [np.zeros(feature_extractor.sampling_rate, dtype=np.float32)] * 2,
+        sampling_rate=feature_extractor.sampling_rate,
+        return_tensors="pt",
+    )
+    name = feature_extractor.model_input_names[0]
+    axes = {0: "batch"} if getattr(feature_extractor, "n_samples", None) else {0: "batch", sample[name].dim() - 1: "frames"}
+    return artifact(
+        model_id,
+        lambda: AutoModelForAudioClassification.from_pretrained(model_id),
+        {name: sample[name]},
+        {name: axes},
+        quantize,
+    )
@@ -0,0 +1,102 @@
+import io
+
+import numpy as np
+import torch
+from metrics import registry
+from PIL import Image, ImageOps
+from transformers import AutoImageProcessor, AutoModelForImageClassification
+
+FACE_MODEL = "trpakov/vit-face-expression"
+# the face model's labels mapped onto the keys of models.emotion_dict
+LABELS = {
+    "angry": "anger",
+    "disgust": "disgust",
+    "fear": "fear",
+    "happy": "joy",
+    "neutral": "neutral",
+    "sad": "sadness",
+    "surprise": "surprise",
+}
+
+
+def load_face_detector():
+    try:
+        import cv2
+    except ImportError:
+        return None
+    return cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+
+
+class FaceEmotionClassifier:
+    """
+    Local CPU alternative to the OpenAI vision call. Finds the faces in each frame and classifies the crops
+    of a whole batch of frames in one forward pass. Frames without a detected face (or without OpenCV
+    installed) are classified whole.
+    """
+
+    def __init__(self, model_id=FACE_MODEL, device="cpu", min_face=48, margin=0.2, max_side=640):
+        self.device = torch.device(device)
+        self.processor = AutoImageProcessor.from_pretrained(model_id)
+        self.model = AutoModelForImageClassification.from_pretrained(model_id).to(self.device).eval()
+        id2label = self.model.config.id2label
+        self.labels = [LABELS.get(id2label[i].lower(), id2label[i].lower()) for i in range(len(id2label))]
+        self.detector = load_face_detector()
+        self.min_face = min_face
+        self.margin = margin
+        self.max_side = max_side
+
+    def load(self, frame: bytes):
+        with Image.open(io.BytesIO(frame)) as image:
+            image = ImageOps.exif_transpose(image).convert("RGB")
+        image.thumbnail((self.max_side, self.max_side))
+        return image
+
+    def faces(self, image):
+        if self.detector is None:
+            return []
+        boxes = self.detector.detectMultiScale(
+            np.asarray(image.convert("L")), scaleFactor=1.1, minNeighbors=5, minSize=(self.min_face, self.min_face)
+        )
+        crops = []
+        for x, y, w, h in boxes:
+            pad = int(max(w, h) * self.margin)
+            crops.append(image.crop((max(x - pad, 0), max(y - pad, 0), min(x + w + pad, image.width), min(y + h + pad, image.height))))
+        return crops
+
+    def prepare(self, frame: bytes):
+        # the frame's crops and face count, or the error that kept it from decoding
+        try:
+            image = self.load(frame)
+            crops = self.faces(image)
+        except Exception as e:
+            return None, 0, repr(e)
+        return crops or [image], len(crops), None
+
+    def classify(self, frames: list) -> list:
+        """
+        One result per frame: the mean emotion distribution over its faces, the number of faces found
+        and the top probability of that distribution. A frame that can't be decoded gets {"error": ...}
+        instead, so one corrupt upload doesn't fail the other frames batched with it.
+        """
+        with registry.stage("face_detect"):
+            prepared = [self.prepare(frame) for frame in frames]
+        batch = [crop for crops, _, error in prepared if error is None for crop in crops]
+        if batch:
+            inputs = self.processor(images=batch, return_tensors="pt")
+            with torch.no_grad(), registry.stage("face_model"):
+                logits = self.model(**{key: value.to(self.device) for key, value in inputs.items()}).logits
+            probabilities = torch.softmax(logits, dim=-1).cpu()
+
+        results, offset = [], 0
+        for crops, faces, error in prepared:
+            if error is not None:
+                results.append({"error": error})
+                continue
+            mean = probabilities[offset : offset + len(crops)].mean(dim=0)
+            offset += len(crops)
+            emotions = dict.fromkeys(LABELS.values(), 0.0)
+            for label, probability in zip(self.labels, mean.tolist()):
+                if label in emotions:
+                    emotions[label] += probability
+            results.append({"emotions": emotions, "faces": faces, "confidence": mean.max().item()})
+        return results
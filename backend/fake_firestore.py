@@ -0,0 +1,339 @@
+import copy
+import operator
+import threading
+from collections import Counter
+from types import SimpleNamespace
+from uuid import uuid4
+
+from firebase_admin import firestore
+from google.api_core import exceptions
+
+
+def apply(current, value):
+    # resolves field transforms against the stored value, recursing into nested maps like set(merge=True)
+    if isinstance(value, firestore.ArrayUnion):
+        existing = list(current or [])
+        return existing + [v for v in value.values if v not in existing]
+    if isinstance(value, firestore.Increment):
+        return (current or 0) + value.value
+    if isinstance(value, firestore.Minimum):
+        return value.value if current is None else min(current, value.value)
+    if isinstance(value, firestore.Maximum):
+        return value.value if current is None else max(current, value.value)
+    if isinstance(value, dict):
+        merged = dict(current) if isinstance(current, dict) else {}
+        for key, nested in value.items():
+            merged[key] = apply(merged.get(key), nested)
+        return merged
+    return copy.deepcopy(value)
+
+
+class Snapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class DocumentReference:
+    def __init__(self, store, path):
+        self.store = store
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name):
+        return CollectionReference(self.store, f"{self.path}/{name}")
+
+    def get(self, field_paths=None, transaction=None):
+        if transaction is not None:
+            transaction.reads.setdefault(self.path, self.store.versions[self.path])
+        data = self.store.docs.get(self.path)
+        if data is not None and field_paths is not None:
+            data = {key: value for key, value in data.items() if key in field_paths}
+        return Snapshot(self, data)
+
+    def set(self, data, merge=False):
+        self.store.write(self.path, data, merge)
+
+    def update(self, data):
+        self.store.write(self.path, data, merge=True)
+
+    def delete(self):
+        self.store.delete(self.path)
+
+
+OPERATORS = {"==": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+
+class Query:
+    def __init__(self, store, path, filters=(), orders=(), limit_to=None, after=None):
+        self.store = store
+        self.path = path
+        self.filters = list(filters)
+        self.orders = list(orders)
+        self.limit_to = limit_to
+        self.after = after
+
+    def copy(self, **changes):
+        fields = dict(filters=self.filters, orders=self.orders, limit_to=self.limit_to, after=self.after) | changes
+        return type(self)(self.store, self.path, **fields)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self.copy(filters=self.filters + [(field_path, OPERATORS[op_string], value)])
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self.copy(orders=self.orders + [(field_path, direction == "DESCENDING")])
+
+    def limit(self, count):
+        return self.copy(limit_to=count)
+
+    def start_after(self, snapshot):
+        return self.copy(after=snapshot)
+
+    def count(self):
+        return Aggregation(self)
+
+    def documents(self):
+        prefix = f"{self.path}/"
+        for path in sorted(self.store.docs):
+            if path.startswith(prefix) and "/" not in path[len(prefix) :]:
+                yield DocumentReference(self.store, path), self.store.docs[path]
+
+    def name(self, reference):
+        return reference.id
+
+    def sort_key(self, reference, data):
+        return tuple(self.name(reference) if field == "__name__" else data.get(field) for field, _ in self.orders)
+
+    def stream(self):
+        rows = [
+            (reference, data)
+            for reference, data in self.documents()
+            if all(field in data and compare(data[field], value) for field, compare, value in self.filters)
+        ]
+        for field, descending in reversed(self.orders):
+            rows.sort(key=lambda row: self.name(row[0]) if field == "__name__" else row[1].get(field), reverse=descending)
+        if self.after is not None:
+            after = self.sort_key(self.after.reference, self.after._data) if self.orders else (self.name(self.after.reference),)
+            keys = [self.sort_key(*row) if self.orders else (self.name(row[0]),) for row in rows]
+            rows = [row for row, key in zip(rows, keys) if key > after]
+        for reference, data in rows[: self.limit_to]:
+            yield Snapshot(reference, data)
+
+
+class CollectionGroup(Query):
+    """Every collection named `path` at any depth; documents are ordered by their full path, as in Firestore."""
+
+    def documents(self):
+        for path in sorted(self.store.docs):
+            parts = path.split("/")
+            if len(parts) >= 2 and parts[-2] == self.path:
+                yield DocumentReference(self.store, path), self.store.docs[path]
+
+    def name(self, reference):
+        return reference.path
+
+
+class Aggregation:
+    def __init__(self, query):
+        self.query = query
+
+    def get(self):
+        return [[SimpleNamespace(alias="field_1", value=sum(1 for _ in self.query.stream()))]]
+
+
+class CollectionReference(Query):
+    def __init__(self, store, path):
+        super().__init__(store, path)
+        self.id = path.rsplit("/", 1)[-1]
+
+    def copy(self, **changes):
+        return Query(self.store, self.path, **(dict(filters=self.filters, orders=self.orders, limit_to=self.limit_to, after=self.after) | changes))
+
+    def document(self, document_id=None):
+        return DocumentReference(self.store, f"{self.path}/{document_id or uuid4().hex[:20]}")
+
+    def add(self, data):
+        reference = self.document()
+        reference.set(data)
+        return None, reference
+
+
+class WriteBatch:
+    def __init__(self, store):
+        self.store = store
+        self.writes = []
+
+    def set(self, reference, data, merge=False):
+        self.writes.append((reference.path, data, merge))
+
+    def update(self, reference, data):
+        self.writes.append((reference.path, data, True))
+
+    def delete(self, reference):
+        self.writes.append((reference.path, None, False))
+
+    def commit(self):
+        with self.store.lock:
+            for path, data, merge in self.writes:
+                if data is None:
+                    self.store.delete(path)
+                else:
+                    self.store.write(path, data, merge)
+        self.store.commits += 1
+
+
+class FakeFirestore:
+    """
+    In-memory stand-in for the parts of the Firestore client DBclient uses, for tests and benchmarks.
+    Supports ArrayUnion and Increment transforms on set/update, and optimistic transactions.
+    """
+
+    def __init__(self):
+        self.docs = {}
+        self.versions = Counter()
+        self.commits = 0
+        self.lock = threading.RLock()
+
+    def collection(self, name):
+        return CollectionReference(self, name)
+
+    def document(self, path):
+        return DocumentReference(self, path)
+
+    def collection_group(self, collection_id):
+        return CollectionGroup(self, collection_id)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def transaction(self):
+        return Transaction(self)
+
+    def get_all(self, references):
+        return [reference.get() for reference in references]
+
+    def write(self, path, data, merge):
+        with self.lock:
+            current = dict(self.docs.get(path) or {}) if merge else {}
+            for key, value in data.items():
+                current[key] = apply(current.get(key), value)
+            self.docs[path] = current
+            self.versions[path] += 1
+
+    def delete(self, path):
+        with self.lock:
+            self.docs.pop(path, None)
+            self.versions[path] += 1
+
+
+class AsyncDocumentReference(DocumentReference):
+    def collection(self, name):
+        return AsyncCollectionReference(self.store, f"{self.path}/{name}")
+
+    async def get(self, field_paths=None, transaction=None):
+        with self.store.lock:
+            return DocumentReference.get(self, field_paths, transaction)
+
+    async def set(self, data, merge=False):
+        DocumentReference.set(self, data, merge)
+
+    async def update(self, data):
+        DocumentReference.update(self, data)
+
+
+class AsyncQuery(Query):
+    async def stream(self):
+        for snapshot in Query.stream(self):
+            yield snapshot
+
+
+class AsyncCollectionReference(CollectionReference):
+    def copy(self, **changes):
+        return AsyncQuery(self.store, self.path, **(dict(filters=self.filters, orders=self.orders, limit_to=self.limit_to, after=self.after) | changes))
+
+    def document(self, document_id=None):
+        return AsyncDocumentReference(self.store, f"{self.path}/{document_id or uuid4().hex[:20]}")
+
+    async def add(self, data):
+        reference = self.document()
+        DocumentReference.set(reference, data)
+        return None, reference
+
+    async def stream(self):
+        for snapshot in Query.stream(self):
+            yield snapshot
+
+
+class AsyncWriteBatch(WriteBatch):
+    async def commit(self):
+        WriteBatch.commit(self)
+
+
+class Transaction(WriteBatch):
+    """
+    Just enough of Transaction for google's transactional decorator: the commit is refused with Aborted,
+    and the function retried, when a document read in the transaction has changed since.
+    """
+
+    _read_only = False
+    _max_attempts = 5
+
+    def __init__(self, store):
+        super().__init__(store)
+        self.reads = {}
+        self._id = None
+
+    def _clean_up(self):
+        self.writes, self.reads, self._id = [], {}, None
+
+    def _begin(self, retry_id=None):
+        self._id = uuid4().bytes
+
+    def _rollback(self):
+        self._clean_up()
+
+    def _commit(self):
+        with self.store.lock:
+            if any(self.store.versions[path] != version for path, version in self.reads.items()):
+                raise exceptions.Aborted("transaction read a document that has since changed")
+            WriteBatch.commit(self)
+        self._clean_up()
+
+
+class AsyncTransaction(Transaction):
+    """The same for async_transactional."""
+
+    async def _begin(self, retry_id=None):
+        Transaction._begin(self, retry_id)
+
+    async def _rollback(self):
+        Transaction._rollback(self)
+
+    async def _commit(self):
+        Transaction._commit(self)
+
+
+class AsyncFakeFirestore:
+    """AsyncClient-shaped view over a FakeFirestore's documents."""
+
+    def __init__(self, store: FakeFirestore):
+        self.store = store
+
+    def collection(self, name):
+        return AsyncCollectionReference(self.store, name)
+
+    def document(self, path):
+        return AsyncDocumentReference(self.store, path)
+
+    def batch(self):
+        return AsyncWriteBatch(self.store)
+
+    def transaction(self):
+        return AsyncTransaction(self.store)
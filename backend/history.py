@@ -0,0 +1,146 @@
+import asyncio
+import weakref
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+from prompts import summary_prompt
+
+
+def count_tokens(text: str) -> int:
+    # ~4 characters per token for English text, close enough for budgeting
+    return len(text) // 4 + 1
+
+
+class Transcript:
+    def __init__(self, summary="", summarized=0, count=0):
+        self.summary = summary
+        self.summarized = summarized
+        self.count = count
+        self.lines = deque()
+        self.tokens = 0
+
+    def add(self, line):
+        tokens = count_tokens(line)
+        self.lines.append((line, tokens))
+        self.tokens += tokens
+
+    def pop(self):
+        line, tokens = self.lines.popleft()
+        self.tokens -= tokens
+        self.summarized += 1
+        return line
+
+    def meta(self):
+        return {"count": self.count, "summarized": self.summarized, "summary": self.summary}
+
+
+class ChatHistory:
+    """
+    Per-user chat transcripts for /reflect, cached in memory and appended to incrementally.
+    Messages are stored in fixed-size pages under users/{uid}/chat_pages; turns that no longer
+    fit the token budget are folded into a rolling summary kept on the user document.
+    Other workers append to the same chats, so a cached transcript is reloaded whenever the stored
+    count or summary position has moved, and only the `max_users` most recent ones are kept.
+    """
+
+    def __init__(self, db, llm, token_budget=1500, summary_budget=300, page_size=50, max_users=1024):
+        self.db = db
+        self.llm = llm
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.page_size = page_size
+        self.max_users = max_users
+        self.transcripts = OrderedDict()
+        # a lock lives as long as someone holds or waits on it
+        self.locks = weakref.WeakValueDictionary()
+
+    def lock(self, user_id):
+        lock = self.locks.get(user_id)
+        if lock is None:
+            lock = self.locks[user_id] = asyncio.Lock()
+        return lock
+
+    async def load(self, user_id, meta=None) -> Transcript:
+        if meta is None:
+            meta = await self.db.get_chat_meta_async(user_id)
+        if meta is None:
+            # first visit since paging: import the old messages array once; if another worker got there
+            # first, its import is kept and read back below like any other chat
+            messages = await self.db.get_legacy_messages_async(user_id)
+            meta = {"count": 0, "summarized": 0, "summary": ""}
+            meta = await self.db.add_chat_messages_async(user_id, messages, meta, self.page_size, only_if_new=True)
+        pages = range(meta["summarized"] // self.page_size, (meta["count"] - 1) // self.page_size + 1)
+        messages = await self.db.get_chat_pages_async(user_id, pages) if meta["count"] else []
+        messages = messages[meta["summarized"] - pages.start * self.page_size :]
+
+        transcript = Transcript(meta["summary"], meta["summarized"], meta["count"])
+        for message in messages:
+            transcript.add(self.db.format_messages([message]))
+        return transcript
+
+    async def get(self, user_id) -> Transcript:
+        meta = await self.db.get_chat_meta_async(user_id)
+        transcript = self.transcripts.get(user_id)
+        if transcript is None or meta is None or (meta["count"], meta["summarized"]) != (transcript.count, transcript.summarized):
+            transcript = await self.load(user_id, meta)
+        self.transcripts[user_id] = transcript
+        self.transcripts.move_to_end(user_id)
+        while len(self.transcripts) > self.max_users:
+            self.transcripts.popitem(last=False)
+        return transcript
+
+    async def prompt(self, user_id) -> str:
+        transcript = await self.get(user_id)
+        budget = self.token_budget - (count_tokens(transcript.summary) if transcript.summary else 0)
+
+        # newest turns first until the budget is spent
+        lines = []
+        for line, tokens in reversed(transcript.lines):
+            if tokens > budget:
+                break
+            lines.append(line)
+            budget -= tokens
+        history = "\n".join(reversed(lines))
+        if transcript.summary:
+            history = f"Summary of earlier conversation: {transcript.summary}\n{history}"
+        return history
+
+    async def append(self, user_id, prompt, response):
+        now = datetime.now(timezone.utc).isoformat()
+        messages = [
+            {"sender": "user", "content": prompt, "timestamp": now},
+            {"sender": "bot", "content": response, "timestamp": now},
+        ]
+        async with self.lock(user_id):
+            transcript = await self.get(user_id)
+            for message in messages:
+                transcript.add(self.db.format_messages([message]))
+            transcript.count += len(messages)
+
+            if transcript.tokens > self.token_budget - self.summary_budget:
+                try:
+                    await self.summarize(transcript)
+                except Exception as e:
+                    print(f"Summarizing chat history failed: {e}")
+            # the turns land after the committed count, so if another worker appended in the meantime the stored
+            # count moves past transcript.count and the next get() reloads
+            await self.db.add_chat_messages_async(user_id, messages, transcript.meta(), self.page_size)
+
+    async def summarize(self, transcript):
+        # fold the oldest turns in until the unsummarized tail is back to half the budget,
+        # at most one budget's worth per call so an imported backlog drains over several turns
+        target = (self.token_budget - self.summary_budget) // 2
+        folded, tokens, remaining = [], 0, transcript.tokens
+        for line, line_tokens in transcript.lines:
+            if remaining <= target or (folded and tokens + line_tokens > self.token_budget):
+                break
+            folded.append(line)
+            tokens += line_tokens
+            remaining -= line_tokens
+        if not folded:
+            return
+
+        turns = f"Previous summary: {transcript.summary or 'None'}\n\nNew turns:\n" + "\n".join(folded)
+        transcript.summary = await self.llm(summary_prompt.format(self.summary_budget), turns)
+        for _ in folded:
+            transcript.pop()
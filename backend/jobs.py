@@ -0,0 +1,145 @@
+import asyncio
+import functools
+import inspect
+import itertools
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+from metrics import registry
+
+# lower runs first: chat-triggered analyses ahead of uploads, uploads ahead of backfills
+PRIORITIES = {"interactive": 0, "normal": 1, "bulk": 2}
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, kind, priority, fn, args):
+        self.id = uuid4().hex
+        self.kind = kind
+        self.priority = priority
+        self.fn = fn
+        self.args = args
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def view(self) -> dict:
+        view = dict(id=self.id, kind=self.kind, priority=self.priority, status=self.status, created=self.created)
+        if self.started is not None:
+            view["wait_ms"] = (self.started - self.created) * 1000
+        if self.finished is not None:
+            view["run_ms"] = (self.finished - self.started) * 1000
+        if self.status == "done":
+            view["result"] = self.result
+        elif self.status == "failed":
+            view["error"] = self.error
+        return view
+
+
+class JobQueue:
+    """
+    One bounded priority queue per kind of work, each drained by its own pool of workers on the event loop.
+    `submit` raises QueueFull instead of growing a queue past `max_pending`; sync functions run on a thread pool of that kind's size.
+    Finished jobs stay queryable until `history` newer jobs have been submitted.
+    """
+
+    def __init__(self, limits: dict, history=10000, samples=1000):
+        # limits: {kind: (max_pending, concurrency)}
+        self.limits = limits
+        self.queues = {}
+        self.executors = {}
+        self.workers = []
+        self.running = Counter()
+        self.counts = Counter()
+        self.waits = {kind: deque(maxlen=samples) for kind in limits}
+        self.jobs = OrderedDict()
+        self.history = history
+        self.sequence = itertools.count()
+
+    def start(self):
+        # queues and workers belong to the running loop, so they're created on first use
+        for kind, (max_pending, concurrency) in self.limits.items():
+            self.queues[kind] = asyncio.PriorityQueue(maxsize=max_pending)
+            # sync jobs get their own threads, so a full text queue can't take the loop's default executor
+            self.executors[kind] = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"{kind}_jobs")
+            for _ in range(concurrency):
+                self.workers.append(asyncio.ensure_future(self.work(kind)))
+
+    def submit(self, kind, fn, *args, priority="normal") -> Job:
+        if not self.queues:
+            self.start()
+        job = Job(kind, priority, fn, args)
+        try:
+            self.queues[kind].put_nowait((PRIORITIES[priority], next(self.sequence), job))
+        except asyncio.QueueFull:
+            self.counts[f"{kind}.rejected"] += 1
+            registry.inc("mindscape_jobs_rejected_total", kind=kind)
+            raise QueueFull(f"{kind} queue is full ({self.limits[kind][0]} pending)")
+        self.counts[f"{kind}.submitted"] += 1
+        self.jobs[job.id] = job
+        while len(self.jobs) > self.history:
+            self.jobs.popitem(last=False)
+        return job
+
+    def saturated(self, kind):
+        queue = self.queues.get(kind)
+        return queue is not None and queue.full()
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    async def work(self, kind):
+        queue = self.queues[kind]
+        while True:
+            _, _, job = await queue.get()
+            job.status = "running"
+            job.started = time.time()
+            self.waits[kind].append((job.started - job.created) * 1000)
+            registry.observe("mindscape_job_wait_seconds", job.started - job.created, kind=kind)
+            self.running[kind] += 1
+            try:
+                if inspect.iscoroutinefunction(job.fn):
+                    job.result = await job.fn(*job.args)
+                else:
+                    loop = asyncio.get_running_loop()
+                    job.result = await loop.run_in_executor(self.executors[kind], functools.partial(job.fn, *job.args))
+                job.status = "done"
+                self.counts[f"{kind}.done"] += 1
+            except Exception as e:
+                job.status = "failed"
+                job.error = repr(e)
+                self.counts[f"{kind}.failed"] += 1
+                print(f"{kind} job {job.id} failed: {e!r}")
+            finally:
+                job.finished = time.time()
+                registry.observe("mindscape_job_run_seconds", job.finished - job.started, kind=kind, status=job.status)
+                job.fn = job.args = None
+                self.running[kind] -= 1
+                queue.task_done()
+
+    def stats(self) -> dict:
+        stats = {}
+        for kind, (max_pending, concurrency) in self.limits.items():
+            waits = sorted(self.waits[kind])
+            queue = self.queues.get(kind)
+            stats[kind] = dict(
+                queue_depth=queue.qsize() if queue else 0,
+                max_pending=max_pending,
+                running=self.running[kind],
+                concurrency=concurrency,
+                submitted=self.counts[f"{kind}.submitted"],
+                rejected=self.counts[f"{kind}.rejected"],
+                done=self.counts[f"{kind}.done"],
+                failed=self.counts[f"{kind}.failed"],
+                mean_wait_ms=sum(waits) / len(waits) if waits else None,
+                p95_wait_ms=waits[int(0.95 * (len(waits) - 1))] if waits else None,
+            )
+        return stats
@@ -0,0 +1,65 @@
+import asyncio
+import threading
+import time
+
+from metrics import registry
+
+
+class Lazy:
+    """
+    Stands in for a heavy component and builds it with `factory()` on first attribute access.
+    Concurrent first uses wait on the same build; a failed build is retried on the next access.
+    Coroutines should use `await aget()`, which builds (or waits for the build) on a worker thread.
+    """
+
+    def __init__(self, name, factory, warmup=None):
+        self.name = name
+        self.factory = factory
+        self.warmup = warmup
+        self.value = None
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.error = None
+
+    @property
+    def loaded(self):
+        return self.value is not None
+
+    def get(self):
+        if self.value is None:
+            with self.lock:
+                if self.value is None:
+                    start = time.perf_counter()
+                    try:
+                        value = self.factory()
+                    except Exception as e:
+                        self.error = repr(e)
+                        raise
+                    self.timings["load_ms"] = (time.perf_counter() - start) * 1000
+                    registry.set("mindscape_component_load_seconds", self.timings["load_ms"] / 1000, component=self.name)
+                    self.error = None
+                    self.value = value
+                    print(f"loaded {self.name} in {self.timings['load_ms']:.0f} ms")
+        return self.value
+
+    async def aget(self):
+        if self.value is not None:
+            return self.value
+        return await asyncio.to_thread(self.get)
+
+    def prewarm(self):
+        # builds the component and runs its warm-up, e.g. a dummy forward pass, so the first request doesn't pay for it
+        value = self.get()
+        if self.warmup is not None and "warmup_ms" not in self.timings:
+            start = time.perf_counter()
+            self.warmup(value)
+            self.timings["warmup_ms"] = (time.perf_counter() - start) * 1000
+            registry.set("mindscape_component_warmup_seconds", self.timings["warmup_ms"] / 1000, component=self.name)
+        return value
+
+    def status(self) -> dict:
+        warmed = self.loaded and (self.warmup is None or "warmup_ms" in self.timings)
+        return {"loaded": self.loaded, "warmed": warmed, "error": self.error} | self.timings
+
+    def __getattr__(self, attr):
+        return getattr(self.get(), attr)
@@ -1,37 +1,194 @@
+import asyncio
 import os
+import random
+import time
+from collections import Counter
 
+import httpx
+import openai
+from batcher import AsyncMicroBatcher
+from cache import result_cache
 from dotenv import load_dotenv
+from metrics import registry
 from openai import AsyncOpenAI
 
 load_dotenv()
 
+RETRYABLE = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class LLMGateway:
+    """
+    One keep-alive OpenAI client shared by every caller, with a per-model cap on in-flight requests,
+    a per-model token-bucket rate limit and jittered exponential backoff on retryable errors.
+    Set base_url (or OPENAI_BASE_URL) to point it at a local OpenAI-compatible server.
+    """
+
+    def __init__(
+        self,
+        api_key=None,
+        base_url=None,
+        max_concurrency=8,
+        requests_per_second=10,
+        burst=20,
+        max_retries=4,
+        base_delay=0.5,
+        max_delay=8.0,
+        timeout=60.0,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.stats = Counter()
+        self.loop = None
+
+    def setup(self):
+        # the connection pool, semaphores and buckets belong to one event loop; they are only rebuilt
+        # once that loop has closed, e.g. between asyncio.run calls, never under callers still using them
+        loop = asyncio.get_running_loop()
+        if loop is self.loop:
+            return
+        if self.loop is not None and not self.loop.is_closed():
+            raise RuntimeError("LLMGateway is bound to another event loop that is still open; schedule the call on that loop")
+        self.loop = loop
+        self.client = AsyncOpenAI(
+            api_key=self.api_key or os.getenv("OPENAI_KEY"),
+            base_url=self.base_url,
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=4 * self.max_concurrency, max_keepalive_connections=2 * self.max_concurrency),
+            ),
+        )
+        self.semaphores = {}
+        self.buckets = {}
+
+    async def aclose(self):
+        if self.loop is asyncio.get_running_loop():
+            await self.client.close()
+            self.loop = None
+
+    def backoff(self, attempt, error):
+        retry_after = getattr(getattr(error, "response", None), "headers", {}).get("retry-after")
+        try:
+            return min(self.max_delay, float(retry_after))
+        except (TypeError, ValueError):
+            return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def slot(self, model):
+        self.setup()
+        if model not in self.semaphores:
+            self.semaphores[model] = asyncio.Semaphore(self.max_concurrency)
+        return self.semaphores[model]
+
+    async def retry(self, model, create):
+        bucket = self.buckets.setdefault(model, TokenBucket(self.requests_per_second, self.burst))
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire()
+            self.stats[f"{model}.requests"] += 1
+            start, outcome = time.perf_counter(), "error"
+            try:
+                response = await create(self.client)
+                outcome = "ok"
+                return response
+            except RETRYABLE as e:
+                outcome = "retryable"
+                if attempt == self.max_retries:
+                    self.stats[f"{model}.failures"] += 1
+                    raise
+                self.stats[f"{model}.retries"] += 1
+                delay = self.backoff(attempt, e)
+            finally:
+                registry.observe("mindscape_upstream_seconds", time.perf_counter() - start, service="openai", model=model, outcome=outcome)
+            await asyncio.sleep(delay)
+
+    async def request(self, model, create):
+        async with self.slot(model):
+            return await self.retry(model, create)
+
+    async def chat(self, messages, model="gpt-4o-mini", **kwargs):
+        return await self.request(model, lambda client: client.chat.completions.create(messages=messages, model=model, **kwargs))
+
+    async def complete(self, system_prompt: str, user_prompt: str, model="gpt-4o-mini", temperature=0.9) -> str:
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+        chat_completion = await self.chat(messages, model=model, temperature=temperature, stream=False)
+        return chat_completion.choices[0].message.content
+
+    async def stream(self, system_prompt: str, user_prompt: str, model="gpt-4o-mini", temperature=0.9):
+        """Yields content deltas. Retries only happen before the first chunk arrives."""
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+        # the in-flight slot is held for the whole stream, not just the request
+        async with self.slot(model):
+            stream = await self.retry(
+                model, lambda client: client.chat.completions.create(messages=messages, model=model, temperature=temperature, stream=True)
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+    async def moderate(self, text, model="omni-moderation-latest"):
+        return await self.request(model, lambda client: client.moderations.create(model=model, input=text))
+
+
+gateway = LLMGateway()
+
 
 async def llm(system_prompt: str, user_prompt: str) -> str:
-    client = AsyncOpenAI(api_key=os.getenv("OPENAI_KEY"))
+    return await gateway.complete(system_prompt, user_prompt)
+
+
+MODERATION_MODEL = "omni-moderation-latest"
+
+
+async def moderate_texts(texts, chunk_size=32):
+    results = {text: result_cache.get("moderate", MODERATION_MODEL, text) for text in texts}
+    missing = [text for text, result in results.items() if result is None]
+
+    chunks = [missing[i : i + chunk_size] for i in range(0, len(missing), chunk_size)]
+    responses = await asyncio.gather(*(gateway.moderate(chunk, model=MODERATION_MODEL) for chunk in chunks))
+    fresh = [result for response in responses for result in response.to_dict()["results"]]
+    for text, result in zip(missing, fresh):
+        result = {key: result[key] for key in ("flagged", "categories", "category_scores")}
+        results[text] = result_cache.set("moderate", MODERATION_MODEL, text, result)
+    return [results[text] for text in texts]
 
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt},
-    ]
 
-    chat_completion = await client.chat.completions.create(
-        messages=messages,
-        stop=None,
-        model="gpt-4o-mini",
-        temperature=0.9,
-        stream=False,
-    )
-    response = chat_completion.choices[0].message.content
-    return response
+# single-text moderations arriving within a few ms of each other share one upstream call
+moderation_batcher = AsyncMicroBatcher(moderate_texts, max_batch_size=32, max_wait_ms=20, name="moderation")
 
 
 async def openai_moderate(text: str) -> str:
-    client = AsyncOpenAI(api_key=os.getenv("OPENAI_KEY"))
-    response = await client.moderations.create(
-        model="omni-moderation-latest",
-        input=text,
-    )
-    response = response.to_dict()
-    response = response["results"][0]["flagged"]
-    # response.pop("category_applied_input_types")
-    return response
+    response = await moderation_batcher(text)
+    return response["flagged"]
@@ -0,0 +1,155 @@
+import os
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# seconds; spans a cache hit up to a long audio clip through whisper on CPU
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Registry:
+    """
+    Histograms, counters and gauges kept in-process and rendered in the Prometheus text format.
+    Snapshots are plain dicts, so the model server can ship its numbers to the app over its socket.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name, seconds, **labels):
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            counts, total, count = series.get(key(labels), ([0] * len(self.buckets), 0.0, 0))
+            counts = [c + (seconds <= bound) for c, bound in zip(counts, self.buckets)]
+            series[key(labels)] = (counts, total + seconds, count + 1)
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key(labels)] = series.get(key(labels), 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges.setdefault(name, {})[key(labels)] = value
+
+    @contextmanager
+    def time(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def stage(self, stage):
+        return self.time("mindscape_stage_seconds", stage=stage)
+
+    def snapshot(self, process="app") -> dict:
+        with self.lock:
+            return {
+                "buckets": self.buckets,
+                "histograms": {name: dict(series) for name, series in self.histograms.items()},
+                "counters": {name: dict(series) for name, series in self.counters.items()},
+                "gauges": {name: dict(series) for name, series in self.gauges.items()} | process_gauges(process),
+            }
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def process_gauges(process) -> dict:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    labels = key({"process": process})
+    return {
+        "mindscape_process_cpu_seconds": {labels: usage.ru_utime + usage.ru_stime},
+        "mindscape_process_resident_memory_bytes": {labels: rss_bytes()},
+        "mindscape_process_max_resident_memory_bytes": {labels: usage.ru_maxrss * 1024},
+        "mindscape_process_threads": {labels: threading.active_count()},
+    }
+
+
+def labelled(name, labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return name
+    return name + "{" + ",".join(f'{k}="{str(v)}"' for k, v in pairs) + "}"
+
+
+def render(*snapshots) -> str:
+    """Prometheus text exposition of the merged snapshots."""
+    histograms, counters, gauges = {}, {}, {}
+    buckets = snapshots[0]["buckets"] if snapshots else BUCKETS
+    for snapshot in snapshots:
+        for name, series in snapshot["histograms"].items():
+            merged = histograms.setdefault(name, {})
+            for labels, (counts, total, count) in series.items():
+                old = merged.get(labels, ([0] * len(buckets), 0.0, 0))
+                merged[labels] = ([a + b for a, b in zip(old[0], counts)], old[1] + total, old[2] + count)
+        for name, series in snapshot["counters"].items():
+            merged = counters.setdefault(name, Counter())
+            merged.update(series)
+        for name, series in snapshot["gauges"].items():
+            gauges.setdefault(name, {}).update(series)
+
+    lines = []
+    for name, series in sorted(histograms.items()):
+        lines.append(f"# TYPE {name} histogram")
+        for labels, (counts, total, count) in sorted(series.items()):
+            for bound, cumulative in zip(buckets, counts):
+                lines.append(f"{labelled(name + '_bucket', labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{labelled(name + '_bucket', labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{labelled(name + '_sum', labels)} {total}")
+            lines.append(f"{labelled(name + '_count', labels)} {count}")
+    for name, series in sorted(counters.items()):
+        lines.append(f"# TYPE {name} counter")
+        lines.extend(f"{labelled(name, labels)} {value}" for labels, value in sorted(series.items()))
+    for name, series in sorted(gauges.items()):
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(f"{labelled(name, labels)} {value}" for labels, value in sorted(series.items()))
+    return "\n".join(lines) + "\n"
+
+
+IDLE = {("threading.py", "wait"), ("selectors.py", "select"), ("queue.py", "get"), ("connection.py", "_recv"), ("socket.py", "accept")}
+
+
+def sample_stacks(seconds=10.0, interval=0.005, limit=500, skip_idle=True) -> str:
+    """
+    Samples the Python stack of every other thread for `seconds` and returns them in collapsed form,
+    "outer;...;leaf count" per line, most frequent first, ready for flamegraph.pl or speedscope.
+    Threads parked in a wait/select/get are skipped unless `skip_idle` is False.
+    """
+    me = threading.get_ident()
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+            if skip_idle and leaf in IDLE:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)})")
+                frame = frame.f_back
+            stacks[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common(limit)) + "\n"
+
+
+registry = Registry()
@@ -0,0 +1,217 @@
+import argparse
+import asyncio
+import inspect
+import os
+import pickle
+import stat
+import tempfile
+import threading
+from multiprocessing import AuthenticationError, resource_tracker, shared_memory
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+from dotenv import load_dotenv
+from metrics import registry, sample_stacks
+
+SOCKET_PATH = os.path.join(os.getenv("XDG_RUNTIME_DIR") or tempfile.gettempdir(), "mindscape", "models.sock")
+
+
+def load_authkey():
+    # multiprocessing.connection unpickles whatever it receives, so both ends must share a secret
+    key = os.getenv("MODEL_SERVER_AUTHKEY")
+    if not key:
+        raise RuntimeError("MODEL_SERVER_AUTHKEY must be set to share models over a socket")
+    return key.encode()
+
+
+def private_dir(path):
+    """Creates the socket's directory readable only by this user, refusing one that someone else controls."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(f"{path} must be a directory owned by this user with mode 0700")
+
+
+class RemoteError(Exception):
+    """Raised in the client for a server-side exception that doesn't survive pickling, e.g. many torch and HF errors."""
+
+
+def portable_error(e):
+    try:
+        pickle.loads(pickle.dumps(e))
+        return e
+    except Exception:
+        return RemoteError(f"{type(e).__name__}: {e!r}")
+
+
+def close_shared(shm, unlink=False):
+    # a numpy view that is still alive makes close() raise BufferError; the mapping is then freed with the view
+    try:
+        shm.close()
+    except BufferError:
+        pass
+    if unlink:
+        shm.unlink()
+
+
+class SharedArray:
+    """Placeholder sent over the socket in place of a numpy array that lives in shared memory."""
+
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+
+def share_array(array: np.ndarray):
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, SharedArray(shm.name, array.shape, array.dtype.str)
+
+
+def attach_array(spec: SharedArray):
+    shm = shared_memory.SharedMemory(name=spec.name)
+    # the client owns the block, so keep this process's resource tracker from unlinking it
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm, np.ndarray(spec.shape, dtype=np.dtype(spec.dtype), buffer=shm.buf)
+
+
+class ModelServer:
+    """
+    Holds one Analyzer and serves its methods over a Unix socket, one thread per connection.
+    Numpy arguments arrive as SharedArray handles and are mapped without copying.
+    Coroutines from every connection run on one long-lived event loop, the one the LLM gateway is bound to.
+    """
+
+    def __init__(self, analyzer, address=SOCKET_PATH, authkey=None):
+        self.analyzer = analyzer
+        self.address = address
+        self.authkey = authkey or load_authkey()
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="model_server_loop", daemon=True).start()
+
+    def call(self, method, args, kwargs):
+        attached = []
+        args = list(args)
+        for i, arg in enumerate(args):
+            if isinstance(arg, SharedArray):
+                shm, args[i] = attach_array(arg)
+                attached.append(shm)
+        try:
+            attr = getattr(self if method in ("metrics", "profile") else self.analyzer, method)
+            if not callable(attr):
+                return attr
+            result = attr(*args, **kwargs)
+            if inspect.isawaitable(result):
+                result = asyncio.run_coroutine_threadsafe(result, self.loop).result()
+            return result
+        finally:
+            del args
+            for shm in attached:
+                close_shared(shm)
+
+    def metrics(self):
+        return registry.snapshot(process="model_server")
+
+    def profile(self, seconds=10.0, interval=0.005):
+        return sample_stacks(seconds, interval)
+
+    def handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    method, args, kwargs = conn.recv()
+                except EOFError:
+                    return
+                try:
+                    conn.send((True, self.call(method, args, kwargs)))
+                except Exception as e:
+                    conn.send((False, portable_error(e)))
+
+    def serve_forever(self):
+        private_dir(os.path.dirname(os.path.abspath(self.address)))
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        umask = os.umask(0o177)
+        try:
+            listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        os.chmod(self.address, 0o600)
+        with listener:
+            print(f"model server listening on {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except AuthenticationError:
+                    continue
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+
+class ModelClient:
+    """
+    Drop-in stand-in for Analyzer inside FastAPI workers, forwarding every call to a ModelServer.
+    Each thread keeps its own connection since connections are not thread-safe.
+    """
+
+    def __init__(self, address=SOCKET_PATH, authkey=None):
+        self.address = address
+        self.authkey = authkey or load_authkey()
+        self.local = threading.local()
+
+    @property
+    def conn(self):
+        if not hasattr(self.local, "conn"):
+            self.local.conn = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+        return self.local.conn
+
+    def call(self, method, *args, **kwargs):
+        shared = []
+        args = list(args)
+        for i, arg in enumerate(args):
+            if isinstance(arg, np.ndarray):
+                shm, args[i] = share_array(arg)
+                shared.append(shm)
+        try:
+            self.conn.send((method, args, kwargs))
+            ok, result = self.conn.recv()
+        finally:
+            for shm in shared:
+                close_shared(shm, unlink=True)
+        if not ok:
+            raise result
+        return result
+
+    def analyze(self, text, sentences=False):
+        return self.call("analyze", text, sentences=sentences)
+
+    def analyze_audio(self, audio, **kwargs):
+        return self.call("analyze_audio", audio, **kwargs)
+
+    async def analyze_image(self, image, path=False, **kwargs):
+        return await asyncio.to_thread(self.call, "analyze_image", image, path, **kwargs)
+
+    def warmup(self):
+        return self.call("warmup")
+
+    def metrics(self):
+        return self.call("metrics")
+
+    def profile(self, seconds=10.0, interval=0.005):
+        return self.call("profile", seconds, interval)
+
+    def stats(self):
+        return self.call("stats")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the Analyzer models to local FastAPI workers")
+    parser.add_argument("--socket", default=os.getenv("MODEL_SERVER", SOCKET_PATH))
+    args = parser.parse_args()
+
+    load_dotenv()
+    from models import Analyzer
+
+    analyzer = Analyzer()
+    analyzer.warmup()
+    ModelServer(analyzer, args.socket).serve_forever()
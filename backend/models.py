@@ -1,17 +1,29 @@
+import asyncio
 import base64
+import io
 import json
 import os
 import random
+import re
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
 
 import librosa
 import numpy as np
 import torch
+from audio import SAMPLING_RATE
+from batcher import IMAGE_BATCH_SIZE, TEXT_BATCH_SIZE, MicroBatcher
+from cache import result_cache
+from engine import ENGINES, OnnxClassifier, OnnxTextClassifier, audio_artifact, text_artifact
+from faces import FaceEmotionClassifier
 from google.cloud import language_v1, speech
 from google.oauth2 import service_account
-from llm import llm
-from openai import AsyncOpenAI
+from llm import gateway, llm
+from metrics import registry
+from PIL import Image, ImageOps
 from strictjson import strict_json_async
-from transformers import AutoFeatureExtractor, AutoModelForAudioClassification, pipeline
+from transformers import AutoConfig, AutoFeatureExtractor, AutoModelForAudioClassification, pipeline
 
 
 def load_language_client():
@@ -32,17 +44,38 @@ def load_speech_client():
     return client
 
 
-def load_emotion_model():
-    model_id = "firdhokk/speech-emotion-recognition-with-openai-whisper-large-v3"
-    model = AutoModelForAudioClassification.from_pretrained(model_id)
-    feature_extractor = AutoFeatureExtractor.from_pretrained(model_id, do_normalize=True)
+AUDIO_MODEL = "firdhokk/speech-emotion-recognition-with-openai-whisper-large-v3"
+TEXT_MODEL = "j-hartmann/emotion-english-distilroberta-base"
+# local stand-in for Google NL's document score: positive minus negative probability
+SENTIMENT_MODEL = "cardiffnlp/twitter-roberta-base-sentiment-latest"
+
+
+def load_emotion_model(engine="torch"):
+    feature_extractor = AutoFeatureExtractor.from_pretrained(AUDIO_MODEL, do_normalize=True)
+    if feature_extractor.sampling_rate != SAMPLING_RATE:
+        # uploads are decoded at SAMPLING_RATE before the model is loaded
+        raise ValueError(f"{AUDIO_MODEL} expects {feature_extractor.sampling_rate} Hz audio, audio.SAMPLING_RATE is {SAMPLING_RATE}")
+    if engine == "onnx":
+        model = OnnxClassifier(audio_artifact(AUDIO_MODEL, feature_extractor), AutoConfig.from_pretrained(AUDIO_MODEL))
+    else:
+        model = AutoModelForAudioClassification.from_pretrained(AUDIO_MODEL)
     return model, feature_extractor
 
 
-def load_text_model():
+# bump when a prompt or model changes so cached results from the old one stop matching
+TEXT_VERSION = f"{TEXT_MODEL}+google-nl/2"
+IMAGE_VERSION = "gpt-4o-mini/1"
+# openai: every frame goes to the vision model; local: the on-device face classifier only;
+# hybrid: local first, falling back to openai when no face is found or the classifier is unsure
+IMAGE_BACKENDS = ("openai", "local", "hybrid")
+
+
+def load_text_model(engine="torch", model_id=TEXT_MODEL):
+    if engine == "onnx":
+        return OnnxTextClassifier(model_id, text_artifact(model_id))
     model = pipeline(
         "text-classification",
-        model="j-hartmann/emotion-english-distilroberta-base",
+        model=model_id,
         top_k=None,
     )
     return model
@@ -59,13 +92,102 @@ emotion_dict = {
 }
 
 
+image_schema = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "image_emotions",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {**{key: {"type": "integer"} for key in emotion_dict}, "remarks": {"type": "string"}},
+            "required": [*emotion_dict, "remarks"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+def downsize_image(image: bytes, max_side=512, quality=85) -> bytes:
+    # `detail: low` only ever sees a 512px image, so there's no point uploading more than that
+    with Image.open(io.BytesIO(image)) as img:
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        img.thumbnail((max_side, max_side))
+        output = io.BytesIO()
+        img.save(output, format="JPEG", quality=quality)
+    return output.getvalue()
+
+
+# a sentence ends at terminal punctuation followed by whitespace, or at a line break
+SENTENCE_BREAK = re.compile(r"(?<=[.!?…])[\"')\]]*\s+|\s*\n\s*")
+
+
+def split_sentences(text: str) -> list:
+    """(start, end) character spans of the non-blank sentences in `text`."""
+    spans, start = [], 0
+    for match in SENTENCE_BREAK.finditer(text):
+        spans.append((start, match.start()))
+        start = match.end()
+    spans.append((start, len(text)))
+    return [(start, end) for start, end in spans if text[start:end].strip()]
+
+
+def weighted_emotions(scores: list, weights: list) -> dict:
+    total = sum(weights)
+    emotions = {}
+    for score, weight in zip(scores, weights):
+        for label, probability in score.items():
+            emotions[label] = emotions.get(label, 0.0) + probability * weight / total
+    return emotions
+
+
 class Analyzer:
-    def __init__(self):
+    def __init__(
+        self,
+        text_batch_size=TEXT_BATCH_SIZE,
+        text_batch_wait_ms=10,
+        image_backend=None,
+        image_batch_size=IMAGE_BATCH_SIZE,
+        image_batch_wait_ms=20,
+        hybrid_confidence=0.5,
+        engine=None,
+        max_text_tokens=500,
+        sentiment_fallback=None,
+        sentiment_deadline_ms=None,
+        audio=True,
+        audio_batch_size=None,
+    ):
+        self.engine = engine or os.getenv("INFERENCE_ENGINE", "torch")
+        if self.engine not in ENGINES:
+            raise ValueError(f"Unknown inference engine {self.engine}, expected one of {ENGINES}")
+        # int8 scores drift slightly from the fp32 ones, so the two engines don't share cache entries
+        self.text_version = TEXT_VERSION if self.engine == "torch" else f"{TEXT_VERSION}+{self.engine}-int8"
         self.client = load_language_client()
-        self.openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_KEY"))
-        self.text_model = load_text_model()
+        self.text_model = load_text_model(self.engine)
+        self.text_batcher = MicroBatcher(self.classify_texts, text_batch_size, text_batch_wait_ms, name="text_model")
+        # distilroberta sees 512 tokens including <s> and </s>; the rest is slack for BPE merges across chunk joins
+        self.max_text_tokens = max_text_tokens
+        # Google NL runs on these threads while the emotion model runs on the batcher's
+        self.nl_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="google_nl")
+        if sentiment_fallback is None:
+            sentiment_fallback = os.getenv("SENTIMENT_FALLBACK", "").lower() in ("1", "true", "yes")
+        self.sentiment_deadline = (sentiment_deadline_ms or float(os.getenv("SENTIMENT_DEADLINE_MS", 1500))) / 1000
+        self.sentiment_model = self.sentiment_batcher = None
+        if sentiment_fallback:
+            self.sentiment_model = load_text_model(self.engine, SENTIMENT_MODEL)
+            self.sentiment_batcher = MicroBatcher(self.classify_sentiment, text_batch_size, text_batch_wait_ms, name="sentiment_model")
+        self.image_backend = image_backend or os.getenv("IMAGE_BACKEND", "openai")
+        if self.image_backend not in IMAGE_BACKENDS:
+            raise ValueError(f"Unknown image backend {self.image_backend}, expected one of {IMAGE_BACKENDS}")
+        self.hybrid_confidence = hybrid_confidence
+        self.image_batcher = None
+        if self.image_backend != "openai":
+            self.face_model = FaceEmotionClassifier()
+            self.image_batcher = MicroBatcher(self.face_model.classify, image_batch_size, image_batch_wait_ms, name="face_model")
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.emotion_model, self.feature_extractor = load_emotion_model()
+        # text-only users such as the backfill skip loading whisper
+        self.emotion_model, self.feature_extractor = load_emotion_model(self.engine) if audio else (None, None)
+        # whisper-large activations scale with the batch, so long recordings are classified a few windows at a time
+        self.audio_batch_size = audio_batch_size or int(os.getenv("AUDIO_BATCH_SIZE", 4))
         self.emotions = {
             "joy": ["happy", "delighted", "cheerful", "pleased"],
             "trust": ["trustful", "accepting", "confident"],
@@ -90,25 +212,148 @@ class Analyzer:
             ("serenity", "interest"): "optimism",
         }
 
-    def analyze(self, text: str) -> dict:
+    @property
+    def sampling_rate(self):
+        return self.feature_extractor.sampling_rate
+
+    def stats(self) -> dict:
+        stats = {"text_batcher": self.text_batcher.stats()}
+        if self.sentiment_batcher is not None:
+            stats["sentiment_batcher"] = self.sentiment_batcher.stats()
+        if self.image_batcher is not None:
+            stats["image_batcher"] = self.image_batcher.stats()
+        return stats
+
+    def warmup(self):
+        # one dummy pass through each local model so the first request doesn't pay for kernel selection and allocation
+        self.classify_texts(["warming up"])
+        if self.sentiment_model is not None:
+            self.classify_sentiment(["warming up"])
+        if self.emotion_model is not None:
+            self.classify_windows([np.zeros(self.feature_extractor.sampling_rate, dtype=np.float32)])
+        if self.image_batcher is not None:
+            frame = io.BytesIO()
+            Image.new("RGB", (64, 64)).save(frame, format="JPEG")
+            self.face_model.classify([frame.getvalue()])
+
+    def analyze(self, text: str, sentences=False) -> dict:
+        """
+        Google NL sentiment plus the text model's emotions, computed at the same time. Text longer than the
+        model's window is split into sentence-aligned chunks whose scores are averaged by token count. With
+        `sentences`, every sentence is scored too, in the same batches, for highlighting.
+
+        With the local sentiment fallback enabled, a Google call that fails or misses the deadline is
+        replaced by the local model's score; `score_backend` says which one produced it.
+        """
+        namespace = "analyze+sentences" if sentences else "analyze"
+        cached = result_cache.get(namespace, self.text_version, text)
+        if cached is not None:
+            # sentence text isn't cached, only its span, so it's cut from the note again
+            for sentence in cached.get("sentences", []):
+                sentence["text"] = text[sentence["start"] : sentence["end"]]
+            return cached
+
+        start = time.perf_counter()
+        google = self.nl_pool.submit(self.google_sentiment, text)
+        emotions = self.text_emotions(text, sentences)
+        try:
+            # without a local model there's nothing to fall back to, so wait for Google as before
+            timeout = None if self.sentiment_model is None else max(self.sentiment_deadline - (time.perf_counter() - start), 0)
+            score = google.result(timeout=timeout)
+        except Exception as e:
+            if self.sentiment_model is None:
+                raise
+            reason = "deadline" if isinstance(e, TimeoutError) else "error"
+            registry.inc("mindscape_sentiment_fallbacks_total", reason=reason)
+            print(f"google nl {reason}, scoring sentiment locally: {e!r}")
+            # not cached, so Google gets another chance at this text next time
+            return {"score": self.local_sentiment(text), "score_backend": "local"} | emotions
+        result = {"score": score, "score_backend": "google-nl"} | emotions
+        stored = result | {"sentences": [{k: v for k, v in sentence.items() if k != "text"} for sentence in result["sentences"]]} if sentences else result
+        result_cache.set(namespace, self.text_version, text, stored)
+        return result
+
+    def google_sentiment(self, text: str) -> float:
         document = language_v1.Document(
             content=text,
             type_=language_v1.Document.Type.PLAIN_TEXT,
         )
-        sentiment = self.client.analyze_sentiment(document=document)
-        emotion_results = self.text_model(text)[0]
-        return {
-            "score": sentiment.document_sentiment.score,
-            "emotions": {emotion["label"]: emotion["score"] for emotion in emotion_results},
-        }
+        with registry.stage("google_nl"):
+            return self.client.analyze_sentiment(document=document).document_sentiment.score
 
-    async def analyze_image(self, image, path=False):
-        if path:
-            image = open(image, "rb").read()
-        base64_image = base64.b64encode(image).decode("utf-8")
-        response = await self.openai_client.chat.completions.create(
+    def local_sentiment(self, text: str) -> float:
+        _, chunks = self.chunk_text(text)
+        texts = [text[start:end] for start, end, _ in chunks] if len(chunks) > 1 else [text]
+        futures = [self.sentiment_batcher.submit(chunk) for chunk in texts]
+        scores = [future.result() for future in futures]
+        if len(chunks) > 1:
+            probabilities = weighted_emotions(scores, [tokens for _, _, tokens in chunks])
+        else:
+            probabilities = scores[0]
+        return probabilities.get("positive", 0.0) - probabilities.get("negative", 0.0)
+
+    def chunk_text(self, text: str, max_tokens=None):
+        """
+        Sentence spans as (start, end, tokens) and the chunks they pack into, greedily and in order,
+        up to `max_tokens` each. A sentence over the limit is cut on token boundaries. One tokenizer
+        pass over the whole text, so this is linear in its length.
+        """
+        max_tokens = max_tokens or self.max_text_tokens
+        offsets = self.text_model.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+        starts = [start for start, _ in offsets]
+        pieces = []
+        for start, end in split_sentences(text):
+            first, last = bisect_left(starts, start), bisect_left(starts, end)
+            for i in range(first, last, max_tokens):
+                j = min(i + max_tokens, last)
+                pieces.append((offsets[i][0], offsets[j - 1][1], j - i))
+
+        chunks = []
+        for start, end, tokens in pieces:
+            if chunks and chunks[-1][2] + tokens <= max_tokens:
+                chunks[-1] = (chunks[-1][0], end, chunks[-1][2] + tokens)
+            else:
+                chunks.append((start, end, tokens))
+        return pieces, chunks
+
+    def text_emotions(self, text: str, sentences=False) -> dict:
+        pieces, chunks = self.chunk_text(text)
+        if len(chunks) <= 1 and not sentences:
+            return {"emotions": self.text_batcher(text)}
+
+        # a single chunk is the whole text, so short notes score exactly as before
+        texts = [text[start:end] for start, end, _ in chunks] if len(chunks) > 1 else [text]
+        if sentences:
+            texts += [text[start:end] for start, end, _ in pieces]
+        # submitted together so they fill the batcher's batches instead of queueing one by one
+        futures = [self.text_batcher.submit(chunk) for chunk in texts]
+        scores = [future.result() for future in futures]
+
+        if len(chunks) > 1:
+            result = {"emotions": weighted_emotions(scores[: len(chunks)], [tokens for _, _, tokens in chunks]), "chunks": len(chunks)}
+        else:
+            result = {"emotions": scores[0]}
+        if sentences:
+            result["sentences"] = [
+                dict(start=start, end=end, text=text[start:end], emotions=score)
+                for (start, end, _), score in zip(pieces, scores[-len(pieces) :] if pieces else [])
+            ]
+        return result
+
+    def classify_texts(self, texts: list) -> list:
+        with registry.stage("text_model"):
+            results = self.text_model(texts, batch_size=len(texts), truncation=True)
+        return [{emotion["label"]: emotion["score"] for emotion in emotions} for emotions in results]
+
+    def classify_sentiment(self, texts: list) -> list:
+        with registry.stage("sentiment_model"):
+            results = self.sentiment_model(texts, batch_size=len(texts), truncation=True)
+        return [{label["label"].lower(): label["score"] for label in labels} for labels in results]
+
+    async def vision_scores(self, base64_image, structured=True):
+        response = await gateway.chat(
             model="gpt-4o-mini",
-            response_format={"type": "json_object"},
+            response_format=image_schema if structured else {"type": "json_object"},
             messages=[
                 {
                     "role": "user",
@@ -122,36 +367,189 @@ class Analyzer:
                 }
             ],
         )
+        return dict(json.loads(response.choices[0].message.content))
+
+    async def analyze_image(self, image, path=False, backend=None, **kwargs):
+        """
+        Returns (emotions, remarks, timings) from the configured image backend, see IMAGE_BACKENDS.
+        Local frames are micro-batched so concurrent uploads share one forward pass.
+        """
+        start = time.perf_counter()
+        if path:
+            image = open(image, "rb").read()
+        backend = backend or self.image_backend
+        if backend == "openai":
+            return await self.analyze_image_openai(image, **kwargs)
+        if self.image_batcher is None:
+            raise ValueError(f"The {backend} image backend needs the Analyzer to be created with it")
+
+        result = await asyncio.wrap_future(self.image_batcher.submit(image))
+        if "error" in result:
+            raise ValueError(f"Could not read the image: {result['error']}")
+        timings = {"local_ms": (time.perf_counter() - start) * 1000}
+        if backend == "hybrid" and (not result["faces"] or result["confidence"] < self.hybrid_confidence):
+            emotions, remarks, openai_timings = await self.analyze_image_openai(image, **kwargs)
+            timings |= openai_timings
+            timings["total_ms"] = (time.perf_counter() - start) * 1000
+            registry.observe("mindscape_stage_seconds", timings["local_ms"] / 1000, stage="image_local")
+            return emotions, remarks, timings
+
+        emotions = result["emotions"]
+        remarks = f"{result['faces']} face(s) detected, mostly showing {max(emotions, key=emotions.get)}"
+        timings["total_ms"] = timings["local_ms"]
+        registry.observe("mindscape_stage_seconds", timings["local_ms"] / 1000, stage="image_local")
+        return emotions, remarks, timings
+
+    async def analyze_image_openai(self, image, fast=True, second_opinion=False):
+        """
+        The fast mode downsizes the frame to what `detail: low` sees and gets scores and remarks from one
+        structured call; a second opinion, if asked for, is a concurrent call.
+        The full mode is the original vision call followed by a text-only second opinion on the remarks.
+        """
+        start = time.perf_counter()
+        timings = {}
+        version = f"{IMAGE_VERSION}/{'fast' if fast else 'full'}{'+second' if second_opinion else ''}"
+        cached = result_cache.get("analyze_image", version, image)
+        if cached is not None:
+            # remarks describe the person in the frame, so only the scores are kept
+            return cached, None, {"cache_ms": (time.perf_counter() - start) * 1000}
+
+        if fast:
+            stage = time.perf_counter()
+            base64_image = base64.b64encode(downsize_image(image)).decode("utf-8")
+            timings["resize_ms"] = (time.perf_counter() - stage) * 1000
+
+            stage = time.perf_counter()
+            opinions = await asyncio.gather(*[self.vision_scores(base64_image) for _ in range(2 if second_opinion else 1)])
+            timings["vision_ms"] = (time.perf_counter() - stage) * 1000
+            d1, d2 = opinions[0], opinions[-1]
+            remarks = d1.pop("remarks")
+        else:
+            base64_image = base64.b64encode(image).decode("utf-8")
+            stage = time.perf_counter()
+            d1 = await self.vision_scores(base64_image, structured=False)
+            timings["vision_ms"] = (time.perf_counter() - stage) * 1000
+            remarks = d1.pop("remarks")
 
-        d1 = dict(json.loads(response.choices[0].message.content))
-        remarks = d1.pop("remarks")
+            stage = time.perf_counter()
+            system_prompt = f"Evaluate the emotional state of the person described by the following situation and Classify the emotion percentages for each of the 7 emotions - {','.join(list(emotion_dict.keys()))}"
+            d2 = await strict_json_async(system_prompt=system_prompt, user_prompt=remarks, output_format=emotion_dict, llm=llm)
+            timings["second_opinion_ms"] = (time.perf_counter() - stage) * 1000
 
-        system_prompt = f"Evaluate the emotional state of the person described by the following situation and Classify the emotion percentages for each of the 7 emotions - {','.join(list(emotion_dict.keys()))}"
-        d2 = await strict_json_async(system_prompt=system_prompt, user_prompt=remarks, output_format=emotion_dict, llm=llm)
-        response = {key: random.uniform(d1[key], d2[key]) / 100 for key in d1}
-        return response, remarks
+        response = {key: random.uniform(d1[key], d2[key]) / 100 for key in emotion_dict}
+        result_cache.set("analyze_image", version, image, response)
+        timings["total_ms"] = (time.perf_counter() - start) * 1000
+        for name, ms in timings.items():
+            registry.observe("mindscape_stage_seconds", ms / 1000, stage=f"image_{name.removesuffix('_ms')}")
+        return response, remarks, timings
+
+    def load_audio(self, audio):
+        # decoded buffers from audio.decode_audio are used as-is, paths are decoded with librosa
+        if isinstance(audio, np.ndarray):
+            return audio
+        audio_array, _ = librosa.load(audio, sr=self.feature_extractor.sampling_rate)
+        return audio_array
 
     def preprocess_audio(self, audio_path, max_duration=30.0):
-        audio_array, sampling_rate = librosa.load(audio_path, sr=self.feature_extractor.sampling_rate)
+        audio_array = self.load_audio(audio_path)
 
         max_length = int(self.feature_extractor.sampling_rate * max_duration)
         if len(audio_array) > max_length:
             audio_array = audio_array[:max_length]
         else:
             audio_array = np.pad(audio_array, (0, max_length - len(audio_array)))
-        inputs = self.feature_extractor(
-            audio_array,
-            sampling_rate=self.feature_extractor.sampling_rate,
-            max_length=max_length,
-            truncation=True,
-            return_tensors="pt",
-        )
+        with registry.stage("audio_features"):
+            inputs = self.feature_extractor(
+                audio_array,
+                sampling_rate=self.feature_extractor.sampling_rate,
+                max_length=max_length,
+                truncation=True,
+                return_tensors="pt",
+            )
         return {key: value.to(self.device) for key, value in inputs.items()}
 
-    def analyze_audio(self, audio_path):
+    def split_audio(self, audio_array, window_seconds=30.0, hop_seconds=25.0, top_db=40):
+        """
+        Drops silent stretches and cuts the remaining voiced audio into overlapping windows.
+        Returns the windows and their (start, end) sample offsets in the original clip.
+        """
+        sampling_rate = self.feature_extractor.sampling_rate
+        window, hop = int(window_seconds * sampling_rate), int(hop_seconds * sampling_rate)
+
+        intervals = librosa.effects.split(audio_array, top_db=top_db)
+        if len(intervals) == 0:
+            intervals = np.array([[0, len(audio_array)]])
+        voiced = np.concatenate([audio_array[start:end] for start, end in intervals])
+        offsets = np.cumsum([0] + [end - start for start, end in intervals])
+
+        def to_original(i):
+            idx = min(np.searchsorted(offsets, i, side="right") - 1, len(intervals) - 1)
+            return int(intervals[idx][0] + i - offsets[idx])
+
+        windows, spans = [], []
+        start = 0
+        while True:
+            stop = min(start + window, len(voiced))
+            windows.append(voiced[start:stop])
+            spans.append((to_original(start), to_original(stop - 1) + 1))
+            if stop >= len(voiced):
+                break
+            start += hop
+        return windows, spans
+
+    def classify_windows(self, windows, max_batch_size=None):
+        # whisper-style extractors only accept a fixed-length input, others are padded to the longest window
+        fixed_length = getattr(self.feature_extractor, "n_samples", None)
+        padding = dict(padding="max_length", max_length=fixed_length, truncation=True) if fixed_length else dict(padding="longest")
+        max_batch_size = max_batch_size or self.audio_batch_size
+
+        probabilities = []
+        for i in range(0, len(windows), max_batch_size):
+            with registry.stage("audio_features"):
+                inputs = self.feature_extractor(
+                    windows[i : i + max_batch_size],
+                    sampling_rate=self.feature_extractor.sampling_rate,
+                    return_tensors="pt",
+                    **padding,
+                )
+            with torch.no_grad(), registry.stage("audio_model"):
+                logits = self.emotion_model(**{key: value.to(self.device) for key, value in inputs.items()}).logits
+            probabilities.append(torch.softmax(logits, dim=-1))
+        return torch.cat(probabilities)
+
+    def analyze_audio(self, audio_path, windowed=True, **window_config):
+        if not windowed:
+            return self.analyze_audio_padded(audio_path)
+
+        audio_array = self.load_audio(audio_path)
+        with registry.stage("audio_split"):
+            windows, spans = self.split_audio(audio_array, **window_config)
+        probabilities = self.classify_windows(windows)
+
+        id2label = self.emotion_model.config.id2label
+        weights = torch.tensor([len(window) for window in windows], dtype=probabilities.dtype, device=probabilities.device)
+        combined = (probabilities * weights[:, None]).sum(dim=0) / weights.sum()
+
+        sampling_rate = self.feature_extractor.sampling_rate
+        segments = [
+            {
+                "start": start / sampling_rate,
+                "end": end / sampling_rate,
+                "predicted_emotion": id2label[torch.argmax(probs).item()],
+                "emotion_scores": {id2label[i]: prob.item() for i, prob in enumerate(probs)},
+            }
+            for (start, end), probs in zip(spans, probabilities)
+        ]
+        return {
+            "predicted_emotion": id2label[torch.argmax(combined).item()],
+            "emotion_scores": {id2label[i]: prob.item() for i, prob in enumerate(combined)},
+            "segments": segments,
+        }
+
+    def analyze_audio_padded(self, audio_path):
         inputs = self.preprocess_audio(audio_path)
 
-        with torch.no_grad():
+        with torch.no_grad(), registry.stage("audio_model"):
             outputs = self.emotion_model(**inputs)
         logits = outputs.logits
         predicted_id = torch.argmax(logits, dim=-1).item()
@@ -36,5 +36,8 @@ user_prompt = """
 {}
 """
 
+summary_prompt = """
+You maintain a running summary of a therapy conversation between a Therapist and a Patient. Merge the previous summary with the new turns into one updated summary in plain text. Keep the patient's key concerns, emotions, events and anything the therapist suggested. Stay under {} tokens."""
+
 
 reflect_prompt = prompt4
@@ -0,0 +1,98 @@
+import datetime
+
+from firebase_admin import firestore
+
+PERIODS = ("day", "week", "month")
+
+
+def bucket(period, when: datetime.date):
+    """Returns the rollup document id and the first day it covers, e.g. ('2024-W45', '2024-11-04')."""
+    if period == "day":
+        start = when
+        key = start.isoformat()
+    elif period == "week":
+        start = when - datetime.timedelta(days=when.weekday())
+        year, week, _ = when.isocalendar()
+        key = f"{year}-W{week:02d}"
+    elif period == "month":
+        start = when.replace(day=1)
+        key = f"{start.year}-{start.month:02d}"
+    else:
+        raise ValueError(f"Unknown rollup period {period}")
+    return key, start.isoformat()
+
+
+def rollup_updates(sentiment, previous=None):
+    """
+    Field transforms that fold one sentiment into its day, week and month rollups.
+    Every field is an Increment/Minimum/Maximum so concurrent writers never need to read first.
+    With `previous`, the stored version of a sentiment being rescored, its contribution is taken back out first.
+    Counts, sums and emotions come out exact, but score_min/score_max can only widen, so a bucket the old score
+    leaves keeps its old bounds until the rollups are rebuilt.
+    """
+    changes = {}
+    for sign, item in ((-1, previous), (1, sentiment)):
+        if item is None:
+            continue
+        for (period, key), totals in rollup_totals([item]).items():
+            change = changes.setdefault((period, key), {"period": period, "start": totals["start"], "count": 0, "score_sum": 0, "emotions": {}, "types": {}})
+            change["count"] += sign * totals["count"]
+            change["score_sum"] += sign * totals["score_sum"]
+            for field in ("emotions", "types"):
+                for name, value in totals[field].items():
+                    change[field][name] = change[field].get(name, 0) + sign * value
+            if sign > 0:
+                change["score_min"], change["score_max"] = totals["score_min"], totals["score_max"]
+
+    updates = []
+    for (period, key), change in changes.items():
+        data = {
+            "period": period,
+            "start": change["start"],
+            "count": firestore.Increment(change["count"]),
+            "score_sum": firestore.Increment(change["score_sum"]),
+            "emotions": {emotion: firestore.Increment(value) for emotion, value in change["emotions"].items()},
+            "types": {kind: firestore.Increment(value) for kind, value in change["types"].items()},
+        }
+        if "score_min" in change:
+            data["score_min"] = firestore.Minimum(change["score_min"])
+            data["score_max"] = firestore.Maximum(change["score_max"])
+        updates.append((period, key, data))
+    return updates
+
+
+def rollup_totals(sentiments):
+    """
+    Day, week and month rollups built from scratch out of `sentiments`, as {(period, key): data} with
+    plain values in the same shape rollup_updates produces, for overwriting rather than incrementing.
+    """
+    totals = {}
+    for sentiment in sentiments:
+        created = sentiment.get("createdAt") or datetime.datetime.now()
+        when = created.date() if isinstance(created, datetime.datetime) else created
+        score = sentiment.get("score") or 0
+        for period in PERIODS:
+            key, start = bucket(period, when)
+            data = totals.setdefault(
+                (period, key),
+                {"period": period, "start": start, "count": 0, "score_sum": 0, "score_min": score, "score_max": score, "emotions": {}, "types": {}},
+            )
+            data["count"] += 1
+            data["score_sum"] += score
+            data["score_min"] = min(data["score_min"], score)
+            data["score_max"] = max(data["score_max"], score)
+            for emotion, value in (sentiment.get("emotions") or {}).items():
+                data["emotions"][emotion] = data["emotions"].get(emotion, 0) + value
+            kind = sentiment.get("type", "unknown")
+            data["types"][kind] = data["types"].get(kind, 0) + 1
+    return totals
+
+
+def summarize(rollup):
+    # mean and dominant emotion are derived from the stored sums when the rollup is read
+    count = rollup.get("count") or 0
+    emotions = rollup.get("emotions") or {}
+    rollup["score_mean"] = rollup.get("score_sum", 0) / count if count else None
+    rollup["emotion_means"] = {emotion: total / count for emotion, total in emotions.items()} if count else {}
+    rollup["dominant_emotion"] = max(emotions, key=emotions.get) if emotions else None
+    return rollup
@@ -1,5 +1,12 @@
 import json
+import os
+import queue
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote
 
 from bs4 import BeautifulSoup
 from selenium.webdriver import ChromeOptions
@@ -8,6 +15,8 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 from seleniumwire import webdriver
 
+SECTION_XPATH = "//div[@class='info-section']"
+
 
 def create_driver(user_agent=None, headless=True):
     if not user_agent:
@@ -29,22 +38,104 @@ def create_driver(user_agent=None, headless=True):
     return driver
 
 
+def practo_url(city, gender, base=None):
+    base = base or os.getenv("PRACTO_BASE_URL", "https://www.practo.com")
+    return f"{base}/{quote(city, safe='')}/doctors-for-individual-therapy?filters%5Bdoctor_gender%5D%5B%5D={quote(gender, safe='')}"
+
+
+class DriverPool:
+    """
+    Chrome drivers created lazily up to `size` and reused across pages.
+    A driver whose page raised is quit and its slot freed, and waiting longer than `timeout` for one raises TimeoutError.
+    """
+
+    def __init__(self, size=2, factory=create_driver, timeout=120):
+        self.size = size
+        self.factory = factory
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self.lock:
+                if self.created < self.size:
+                    self.created += 1
+                    try:
+                        return self.factory()
+                    except Exception:
+                        self.created -= 1
+                        raise
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"No Chrome driver became free within {self.timeout}s")
+            # wake up periodically in case a broken driver freed its slot instead of returning to the queue
+            try:
+                return self.idle.get(timeout=min(remaining, 1.0))
+            except queue.Empty:
+                pass
+
+    def release(self, driver, broken=False):
+        if broken:
+            with self.lock:
+                self.created -= 1
+            try:
+                driver.quit()
+            except Exception:
+                pass
+            return
+        self.idle.put(driver)
+
+    @contextmanager
+    def driver(self):
+        driver = self.acquire()
+        try:
+            yield driver
+        except BaseException:
+            self.release(driver, broken=True)
+            raise
+        else:
+            self.release(driver)
+
+    def close(self):
+        while True:
+            try:
+                driver = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            driver.quit()
+            with self.lock:
+                self.created -= 1
+
+
 class Scraper:
-    def __init__(self):
-        self.driver = create_driver()
-        self.wait = WebDriverWait(self.driver, 10)
-        self.scroll_config = {"scroll_steps": 3, "scroll_pause": 1.5}
-
-    def scroll(self):
-        if self.scroll_config:
-            total_height = self.driver.execute_script("return document.body.scrollHeight")
-            for _ in range(self.scroll_config.get("scroll_steps", 3)):
-                self.driver.execute_script(f"window.scrollTo(0, {_ * total_height // self.scroll_config.get('scroll_steps', 3)});")
-                time.sleep(self.scroll_config.get("scroll_pause", 1))
-
-            # Scroll to bottom to ensure all content is loaded
-            self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(self.scroll_config.get("scroll_pause", 1))
+    def __init__(self, pool=None):
+        self.pool = pool or DriverPool(size=1)
+        self.scroll_config = {"settle": 1.0, "poll": 0.25, "timeout": 15}
+
+    def count_sections(self, driver):
+        return len(driver.find_elements(By.XPATH, SECTION_XPATH))
+
+    def scroll(self, driver):
+        # keep scrolling until the number of listings stops changing for `settle` seconds
+        config = self.scroll_config
+        deadline = time.monotonic() + config.get("timeout", 15)
+        count, stable_since = -1, time.monotonic()
+        while time.monotonic() < deadline:
+            driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+            current = self.count_sections(driver)
+            if current != count:
+                count, stable_since = current, time.monotonic()
+            elif time.monotonic() - stable_since >= config.get("settle", 1.0):
+                break
+            time.sleep(config.get("poll", 0.25))
+        return count
 
     def scrape_website(self, url, scroll_config=None):
         print(url)
@@ -52,26 +143,143 @@ class Scraper:
             if scroll_config:
                 self.scroll_config = scroll_config
 
-            xpath = "//div[@class='info-section']"
-
-            self.driver.get(url)
-            self.wait.until(EC.presence_of_element_located((By.TAG_NAME, "body")))
+            with self.pool.driver() as driver:
+                driver.get(url)
+                WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.TAG_NAME, "body")))
 
-            self.scroll()
-            elements = self.driver.find_elements(By.XPATH, xpath)
-            print(len(elements))
-            inner_htmls = [div.get_attribute("innerHTML") for div in elements]
-            print(inner_htmls)
-            self.driver.implicitly_wait(10)
-            self.driver.quit()
-            return inner_htmls
+                self.scroll(driver)
+                elements = driver.find_elements(By.XPATH, SECTION_XPATH)
+                print(len(elements))
+                return [div.get_attribute("innerHTML") for div in elements]
 
         except Exception as e:
             print(f"Scraping failed: {e}")
             return None
 
+    def scrape_many(self, urls, max_workers=None):
+        max_workers = min(max_workers or self.pool.size, self.pool.size, len(urls)) or 1
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scraper") as executor:
+            return list(executor.map(self.scrape_website, urls))
+
+
+def serve_fixture(path="fixtures/practo.html", port=0):
+    """
+    Serves one saved listing page for every GET on localhost, for exercising the pool offline:
+    point PRACTO_BASE_URL at f"http://127.0.0.1:{server.server_port}".
+    """
+    with open(path, "rb") as f:
+        page = f.read()
+
+    class FixtureHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(page)))
+            self.end_headers()
+            self.wfile.write(page)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+LISTING_CLASS = "mindscape-listing"
+
+def iter_selectolax(html):
+    from selectolax.lexbor import LexborHTMLParser
+
+    for node in LexborHTMLParser(html).css(f"div.{LISTING_CLASS}, h2.doctor-name, span[data-qa-id]"):
+        if node.tag == "div":
+            yield "listing", None
+        elif node.tag == "h2":
+            yield "doctor-name", node.text()
+        else:
+            yield node.attributes.get("data-qa-id"), node.text()
+
+
+def iter_lxml(html):
+    import lxml.html
+
+    for el in lxml.html.fromstring(html).iter("div", "h2", "span"):
+        if el.tag == "div":
+            if el.get("class") == LISTING_CLASS:
+                yield "listing", None
+        elif el.tag == "h2":
+            if "doctor-name" in (el.get("class") or "").split():
+                yield "doctor-name", el.text_content()
+        elif el.get("data-qa-id"):
+            yield el.get("data-qa-id"), el.text_content()
+
+
+def iter_bs4(html):
+    def match(tag):
+        if tag.name == "div":
+            return LISTING_CLASS in tag.get("class", [])
+        if tag.name == "h2":
+            return "doctor-name" in tag.get("class", [])
+        return tag.name == "span" and tag.has_attr("data-qa-id")
+
+    for tag in BeautifulSoup(html, "html.parser").find_all(match):
+        if tag.name == "div":
+            yield "listing", None
+        elif tag.name == "h2":
+            yield "doctor-name", tag.text
+        else:
+            yield tag["data-qa-id"], tag.text
+
+
+PARSERS = {"selectolax": iter_selectolax, "lxml": iter_lxml, "html.parser": iter_bs4}
+
+
+def default_parser():
+    for name, module in (("selectolax", "selectolax.lexbor"), ("lxml", "lxml.html")):
+        try:
+            __import__(module)
+            return name
+        except ImportError:
+            continue
+    return "html.parser"
+
+
+def create_dict(html_list, gender, parser=None):
+    """
+    Parses every card in one document and collects all fields in a single ordered pass over the tree.
+    Output matches create_dict_bs4; the first occurrence of each field in a card wins, as with soup.find.
+    """
+    if not html_list:
+        # lxml refuses an empty document, and a failed scrape hands over an empty list
+        return []
+    html = "".join(f'<div class="{LISTING_CLASS}">{div}</div>' for div in html_list)
+    cards = []
+    for field, text in PARSERS[parser or default_parser()](html):
+        if field == "listing":
+            cards.append({})
+        elif cards and field not in cards[-1]:
+            cards[-1][field] = text
 
-def create_dict(html_list, gender):
+    data_list = []
+    for card in cards:
+        locality, city = card.get("practice_locality"), card.get("practice_city")
+        reviews, stories = card.get("doctor_recommendation"), card.get("total_feedback")
+        data_list.append(
+            {
+                "name": card.get("doctor-name"),
+                "location": f"{locality} {city}" if locality is not None and city is not None else None,
+                "hospital_name": card.get("doctor_clinic_name"),
+                "consultation_fee": card.get("consultation_fee"),
+                "reviews": reviews.strip("% ") if reviews is not None else None,
+                "stories": stories.split(" ")[0] if stories is not None else None,
+                "gender": gender,
+            }
+        )
+    return data_list
+
+
+def create_dict_bs4(html_list, gender):
+    # reference implementation, one BeautifulSoup tree and up to eight find() calls per card
     data_list = []
     for div in html_list:
         soup = BeautifulSoup(div, "html.parser")
@@ -117,13 +325,15 @@ def create_dict(html_list, gender):
 
 if __name__ == "__main__":
     city = "hyderabad"
-    output = []
+    genders = ["male", "female"]
+
+    pool = DriverPool(size=2)
+    html_lists = Scraper(pool).scrape_many([practo_url(city, gender) for gender in genders])
+    pool.close()
 
-    for gender in ["male", "female"]:
-        url = f"https://www.practo.com/{city}/doctors-for-individual-therapy?filters%5Bdoctor_gender%5D%5B%5D={gender}"
-        s = Scraper()
-        html_list = s.scrape_website(url)
-        output.extend(create_dict(html_list, gender))
+    output = []
+    for gender, html_list in zip(genders, html_lists):
+        output.extend(create_dict(html_list or [], gender))
 
     with open("data.json", "w", encoding="utf-8") as json_file:
         json.dump(output, json_file, ensure_ascii=False, indent=4)
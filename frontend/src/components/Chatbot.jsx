@@ -12,6 +12,9 @@ const cleanBotMessage = (message) => {
   return cleaned;
 };
 
+// the backend keeps the full paginated history, this array only backs the chat window
+const MAX_STORED_MESSAGES = 200;
+
 const ChatBot = () => {
   const [messages, setMessages] = useState([]);
   const [inputValue, setInputValue] = useState('');
@@ -57,7 +60,7 @@ const ChatBot = () => {
     try {
       const userDocRef = doc(db, 'users', user.uid);
       await updateDoc(userDocRef, {
-        messages: newMessages,
+        messages: newMessages.slice(-MAX_STORED_MESSAGES),
         lastUpdated: serverTimestamp()
       });
     } catch (error) {
@@ -65,16 +68,36 @@ const ChatBot = () => {
     }
   };
 
-  const fetchBotResponse = async (userMessage) => {
+  const fetchBotResponse = async (userMessage, onDelta) => {
     try {
-      const response = await fetch(`${import.meta.env.VITE_API_URL}/reflect?prompt=${userMessage}&user_id=${user.uid}`, {
+      const response = await fetch(`${import.meta.env.VITE_API_URL}/reflect_stream?prompt=${encodeURIComponent(userMessage)}&user_id=${user.uid}`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
       });
 
-      const data = await response.text();
+      // server-sent events: each `data:` line carries a JSON-encoded chunk of the reply
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let data = '';
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        for (const event of events) {
+          if (event.startsWith('event: done')) continue;
+          for (const line of event.split('\n')) {
+            if (line.startsWith('data: ')) {
+              data += JSON.parse(line.slice(6));
+              onDelta(data);
+            }
+          }
+        }
+      }
       return cleanBotMessage(data) || cleanBotMessage("I'm here to support you. While I'm a demo bot right now, I'm designed to provide guidance and support for your mental wellness journey.");
     } catch (error) {
       console.error('Error fetching response:', error);
@@ -98,7 +121,10 @@ const ChatBot = () => {
 
     setInputValue('');
 
-    const botResponseText = await fetchBotResponse(inputValue);
+    const timestamp = new Date().toISOString();
+    const botResponseText = await fetchBotResponse(inputValue, (partial) => {
+      setMessages([...updatedMessages, { sender: 'bot', content: partial, timestamp }]);
+    });
     const botMessage = {
       sender: 'bot',
       content: botResponseText,